@@ -0,0 +1,126 @@
+import logging
+import sqlite3
+import statistics
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SINGLE = "single"
+BATCHED = "batched"
+
+
+class AnalysisPlanner:
+    """Chooses single-shot or batched Gemini analysis before the first call.
+
+    Every multimodal call is recorded with its model, image count, payload
+    size, latency and whether it finished; ``model_name`` is the default
+    when a call does not name one. Until ``min_samples`` successful calls
+    exist for the model, the static ``max_images``/``max_bytes`` thresholds
+    decide. After that the planner predicts latency from the median seconds
+    per image and per MiB of recent calls and batches up front whenever the
+    prediction exceeds ``safety`` times the request timeout, or the image
+    count has timed out before.
+    """
+
+    def __init__(
+        self,
+        path,
+        model_name,
+        timeout_seconds,
+        max_images=6,
+        max_bytes=15 * 1024 * 1024,
+        min_samples=5,
+        window=50,
+        safety=0.6,
+    ):
+        self.model_name = model_name
+        self.timeout_seconds = timeout_seconds
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.min_samples = min_samples
+        self.window = window
+        self.safety = safety
+        self._lock = threading.Lock()
+        # The file may be shared with SQLiteStore, which holds write locks.
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS gemini_timings ("
+            " model TEXT NOT NULL,"
+            " images INTEGER NOT NULL,"
+            " bytes INTEGER NOT NULL,"
+            " seconds REAL NOT NULL,"
+            " ok INTEGER NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def record(self, images, total_bytes, seconds, ok=True, model_name=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO gemini_timings VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    model_name or self.model_name,
+                    images,
+                    total_bytes,
+                    seconds,
+                    1 if ok else 0,
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def _recent(self, model_name=None):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT images, bytes, seconds, ok FROM gemini_timings"
+                " WHERE model = ? AND images > 0 ORDER BY created_at DESC LIMIT ?",
+                (model_name or self.model_name, self.window),
+            ).fetchall()
+
+    def thresholds(self, model_name=None):
+        """Return the learned limits, or None while there is too little history."""
+        rows = self._recent(model_name)
+        ok_rows = [row for row in rows if row[3]]
+        if len(ok_rows) < self.min_samples:
+            return None
+        per_image = statistics.median(seconds / images for images, _, seconds, _ in ok_rows)
+        per_mib = statistics.median(
+            seconds / max(total_bytes / (1024 * 1024), 0.01)
+            for _, total_bytes, seconds, _ in ok_rows
+        )
+        failed_counts = [images for images, _, _, ok in rows if not ok]
+        return {
+            "seconds_per_image": per_image,
+            "seconds_per_mib": per_mib,
+            "min_failed_images": min(failed_counts) if failed_counts else None,
+        }
+
+    def predict_seconds(self, images, total_bytes, model_name=None):
+        learned = self.thresholds(model_name)
+        if learned is None:
+            return None
+        return max(
+            learned["seconds_per_image"] * images,
+            learned["seconds_per_mib"] * total_bytes / (1024 * 1024),
+        )
+
+    def plan(self, images, total_bytes, model_name=None):
+        learned = self.thresholds(model_name)
+        if learned is None:
+            if images > self.max_images or total_bytes > self.max_bytes:
+                return BATCHED
+            return SINGLE
+
+        if learned["min_failed_images"] is not None and images >= learned["min_failed_images"]:
+            return BATCHED
+        predicted = self.predict_seconds(images, total_bytes, model_name)
+        if predicted > self.timeout_seconds * self.safety:
+            logger.info(
+                "Predicted %.1fs for %s images (%.1f MiB); batching up front",
+                predicted,
+                images,
+                total_bytes / (1024 * 1024),
+            )
+            return BATCHED
+        return SINGLE
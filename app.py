@@ -1,23 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 from datetime import datetime
+from functools import lru_cache
+import hashlib
 import logging
 import mimetypes
 import os
 import re
-import subprocess
-import sys
 import threading
 import time
 import traceback
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import PlainTextResponse
 from google.api_core import exceptions as google_exceptions
 import google.generativeai as genai
 from google.generativeai import client as genai_client
 from google.generativeai.types import generation_types
 from linebot.v3 import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import (
     ApiClient,
     Configuration,
@@ -27,10 +29,24 @@ from linebot.v3.messaging import (
     TextMessage as LineTextMessage,
 )
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
-import requests
 import uvicorn
 
+import analysis_planner
+from browser_pool import BrowserPool
+import checkpoints
+from event_spool import EventSpool
+from idempotency import IdempotencyStore
+from notion_client import NotionClient
+from gemini_files import GeminiFileCache
+from image_utils import ImagePreprocessor, image_fingerprint
+import job_queue
 from prompts import after_hours_report_prompt, morning_report_prompt
+from rate_limit import RateLimiter
+import usage
+from result_cache import AnalysisCache, ResultCache, prompt_version, voom_post_id
+from store import default_store_url, open_store
+from voom_downloader import context_options, crawl_voom_images, launch_options
+from workspace import JobWorkspace, sweep_expired_workspaces
 
 # Load environment variables
 load_dotenv()
@@ -66,10 +82,15 @@ def _get_env_float(name, default):
 configuration = Configuration(access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
 handler = WebhookHandler(os.getenv("LINE_CHANNEL_SECRET"))
 
-# Reuse LINE API client (keep Flask single-thread or single worker for safety)
+# One LINE API client per worker process; its urllib3 pool is thread-safe.
 _line_api_client = ApiClient(configuration)
 _line_bot_api = MessagingApi(_line_api_client)
 
+# Job state, caches, idempotency keys and locks shared by every worker:
+# sqlite:///file for workers on one host, redis://... across hosts.
+STORE_URL = default_store_url()
+_store = open_store(STORE_URL)
+
 # Configure Gemini API
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 VISION_MODEL_NAME = os.getenv("GEMINI_VISION_MODEL", "gemini-2.5-flash")
@@ -77,20 +98,133 @@ GEMINI_TIMEOUT_SECONDS = _get_env_float("GEMINI_TIMEOUT_SECONDS", 180.0)
 GEMINI_MAX_RETRIES = max(0, _get_env_int("GEMINI_MAX_RETRIES", 2))
 GEMINI_RETRY_BASE_DELAY = _get_env_float("GEMINI_RETRY_BASE_DELAY", 2.0)
 GEMINI_IMAGE_BATCH_SIZE = max(1, _get_env_int("GEMINI_IMAGE_BATCH_SIZE", 3))
+GEMINI_BATCH_CONCURRENCY = max(1, _get_env_int("GEMINI_BATCH_CONCURRENCY", 4))
+GEMINI_REQUESTS_PER_MINUTE = _get_env_float("GEMINI_REQUESTS_PER_MINUTE", 0.0)
+GEMINI_IMAGE_PREPROCESS = os.getenv("GEMINI_IMAGE_PREPROCESS", "1") not in ("0", "false", "False")
+GEMINI_IMAGE_MAX_DIM = max(0, _get_env_int("GEMINI_IMAGE_MAX_DIM", 2048))
+GEMINI_IMAGE_FORMAT = os.getenv("GEMINI_IMAGE_FORMAT", "webp").lower()
+GEMINI_IMAGE_QUALITY = min(100, max(1, _get_env_int("GEMINI_IMAGE_QUALITY", 85)))
+GEMINI_IMAGE_CACHE_DIR = os.getenv("GEMINI_IMAGE_CACHE_DIR", "voom_image_cache")
+GEMINI_PIPELINE = os.getenv("GEMINI_PIPELINE", "0") not in ("0", "false", "False")
+GEMINI_STREAM = os.getenv("GEMINI_STREAM", "0") not in ("0", "false", "False")
+GEMINI_USE_FILE_API = os.getenv("GEMINI_USE_FILE_API", "0") not in ("0", "false", "False")
+GEMINI_DAILY_TOKEN_BUDGET = max(0, _get_env_int("GEMINI_DAILY_TOKEN_BUDGET", 0))
+GEMINI_USER_DAILY_TOKEN_BUDGET = max(0, _get_env_int("GEMINI_USER_DAILY_TOKEN_BUDGET", 0))
+GEMINI_BUDGET_ACTION = os.getenv("GEMINI_BUDGET_ACTION", "refuse").lower()
+GEMINI_DEGRADED_MODEL = os.getenv("GEMINI_DEGRADED_MODEL", "gemini-2.5-flash-lite")
+GEMINI_DEGRADED_IMAGE_MAX_DIM = max(0, _get_env_int("GEMINI_DEGRADED_IMAGE_MAX_DIM", 1024))
+GEMINI_SINGLE_SHOT_MAX_IMAGES = max(1, _get_env_int("GEMINI_SINGLE_SHOT_MAX_IMAGES", 6))
+GEMINI_SINGLE_SHOT_MAX_BYTES = max(1, _get_env_int("GEMINI_SINGLE_SHOT_MAX_BYTES", 15 * 1024 * 1024))
 model = genai.GenerativeModel(VISION_MODEL_NAME)
+_gemini_rate_limiter = RateLimiter(GEMINI_REQUESTS_PER_MINUTE)
+_image_preprocessor = (
+    ImagePreprocessor(
+        GEMINI_IMAGE_CACHE_DIR,
+        max_dim=GEMINI_IMAGE_MAX_DIM,
+        fmt=GEMINI_IMAGE_FORMAT,
+        quality=GEMINI_IMAGE_QUALITY,
+    )
+    if GEMINI_IMAGE_PREPROCESS
+    else None
+)
+_gemini_files = GeminiFileCache(store=_store) if GEMINI_USE_FILE_API else None
+# Over-budget jobs with GEMINI_BUDGET_ACTION=degrade use these instead.
+_degraded_model = genai.GenerativeModel(GEMINI_DEGRADED_MODEL)
+_degraded_image_preprocessor = ImagePreprocessor(
+    GEMINI_IMAGE_CACHE_DIR,
+    max_dim=GEMINI_DEGRADED_IMAGE_MAX_DIM,
+    fmt=GEMINI_IMAGE_FORMAT,
+    quality=GEMINI_IMAGE_QUALITY,
+)
+_current_usage = contextvars.ContextVar("current_usage", default=None)
+_current_checkpoint = contextvars.ContextVar("current_checkpoint", default=None)
 
 VOOM_IMAGES_DIR = "voom_images"
 MAX_VOOM_IMAGES = _get_env_int("MAX_VOOM_IMAGES")
+VOOM_BROWSER_POOL_SIZE = max(1, _get_env_int("VOOM_BROWSER_POOL_SIZE", 2))
+VOOM_BROWSER_RECYCLE_AFTER = max(1, _get_env_int("VOOM_BROWSER_RECYCLE_AFTER", 20))
+VOOM_CRAWL_TIMEOUT_SECONDS = _get_env_float("VOOM_CRAWL_TIMEOUT_SECONDS", 180.0)
+VOOM_WORKERS = max(1, _get_env_int("VOOM_WORKERS", VOOM_BROWSER_POOL_SIZE))
+VOOM_QUEUE_SIZE = max(1, _get_env_int("VOOM_QUEUE_SIZE", 20))
+VOOM_PER_USER_LIMIT = max(1, _get_env_int("VOOM_PER_USER_LIMIT", 2))
+VOOM_SHUTDOWN_TIMEOUT_SECONDS = _get_env_float("VOOM_SHUTDOWN_TIMEOUT_SECONDS", 600.0)
+VOOM_WORKSPACE_TTL_SECONDS = max(0.0, _get_env_float("VOOM_WORKSPACE_TTL_SECONDS", 0.0))
+VOOM_JOB_LEASE_SECONDS = max(60.0, _get_env_float("VOOM_JOB_LEASE_SECONDS", 900.0))
+STORE_PURGE_INTERVAL_SECONDS = max(10.0, _get_env_float("STORE_PURGE_INTERVAL_SECONDS", 600.0))
+VOOM_CACHE_DB = os.getenv("VOOM_CACHE_DB", "voom_cache.sqlite3")
+WEBHOOK_SPOOL_DB = os.getenv("WEBHOOK_SPOOL_DB", "webhook_spool.sqlite3")
+WEBHOOK_SPOOL_WORKERS = max(1, _get_env_int("WEBHOOK_SPOOL_WORKERS", 2))
+WEBHOOK_IDEMPOTENCY_TTL_SECONDS = _get_env_float("WEBHOOK_IDEMPOTENCY_TTL_SECONDS", 24 * 3600.0)
+VOOM_CACHE_TTL_SECONDS = _get_env_float("VOOM_CACHE_TTL_SECONDS", 7 * 24 * 3600.0)
+GEMINI_ANALYSIS_CACHE_TTL_SECONDS = _get_env_float(
+    "GEMINI_ANALYSIS_CACHE_TTL_SECONDS", 30 * 24 * 3600.0
+)
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 NOTION_PARENT_PAGE_MORNING = os.getenv("NOTION_PARENT_PAGE_MORNING_URL")
 NOTION_PARENT_PAGE_AFTER_HOURS = os.getenv("NOTION_PARENT_PAGE_AFTER_HOURS_URL")
 
-NOTION_VERSION = "2022-06-28"
 NOTION_BLOCK_LIMIT = 100
 NOTION_APPEND_BATCH_SIZE = 50
-NOTION_RETRY_STATUSES = {429, 502, 503, 504}
 NOTION_MAX_RETRIES = 3
 NOTION_RETRY_BASE_DELAY = 1.0
+NOTION_POOL_SIZE = max(1, _get_env_int("NOTION_POOL_SIZE", VOOM_WORKERS * 2))
+NOTION_HTTP2 = os.getenv("NOTION_HTTP2", "1") not in ("0", "false", "False")
+NOTION_STREAM_FLUSH_SECONDS = _get_env_float("NOTION_STREAM_FLUSH_SECONDS", 2.0)
+
+_notion = NotionClient(
+    NOTION_TOKEN,
+    pool_size=NOTION_POOL_SIZE,
+    max_retries=NOTION_MAX_RETRIES,
+    retry_base_delay=NOTION_RETRY_BASE_DELAY,
+    http2=NOTION_HTTP2,
+)
+_browser_pool = BrowserPool(
+    size=VOOM_BROWSER_POOL_SIZE,
+    recycle_after=VOOM_BROWSER_RECYCLE_AFTER,
+    launch_options=launch_options(),
+    context_options=context_options(),
+)
+# Cache TTL <= 0 disables the result cache
+_result_cache = (
+    ResultCache(_store, ttl_seconds=VOOM_CACHE_TTL_SECONDS)
+    if VOOM_CACHE_TTL_SECONDS > 0
+    else None
+)
+_analysis_cache = (
+    AnalysisCache(_store, ttl_seconds=GEMINI_ANALYSIS_CACHE_TTL_SECONDS)
+    if GEMINI_ANALYSIS_CACHE_TTL_SECONDS > 0
+    else None
+)
+_analysis_planner = analysis_planner.AnalysisPlanner(
+    VOOM_CACHE_DB,
+    VISION_MODEL_NAME,
+    GEMINI_TIMEOUT_SECONDS,
+    max_images=GEMINI_SINGLE_SHOT_MAX_IMAGES,
+    max_bytes=GEMINI_SINGLE_SHOT_MAX_BYTES,
+)
+_usage_ledger = usage.UsageLedger(
+    VOOM_CACHE_DB,
+    user_daily_budget=GEMINI_USER_DAILY_TOKEN_BUDGET,
+    daily_budget=GEMINI_DAILY_TOKEN_BUDGET,
+    store=_store,
+)
+_idempotency = IdempotencyStore(_store, ttl_seconds=WEBHOOK_IDEMPOTENCY_TTL_SECONDS)
+_event_spool = EventSpool(
+    WEBHOOK_SPOOL_DB,
+    lambda body, signature: handler.handle(body, signature),
+    workers=WEBHOOK_SPOOL_WORKERS,
+)
+_inflight = job_queue.SingleFlight(_store, ttl=VOOM_SHUTDOWN_TIMEOUT_SECONDS + 3600)
+_job_scheduler = job_queue.JobScheduler(
+    workers=VOOM_WORKERS,
+    max_queue=VOOM_QUEUE_SIZE,
+    per_user_limit=VOOM_PER_USER_LIMIT,
+    store=_store,
+)
+_housekeeping_stop = threading.Event()
+# Jobs claimed by _resume_orphaned_jobs that the queue had no room for yet.
+_unqueued_resumes = []
+_resume_lock = threading.Lock()
 
 MODE_PREFIX_MAP = {
     "1": "morning",
@@ -101,14 +235,6 @@ _PREFIX_RE = re.compile(
 )
 
 
-def _clear_voom_images():
-    os.makedirs(VOOM_IMAGES_DIR, exist_ok=True)
-    for name in os.listdir(VOOM_IMAGES_DIR):
-        path = os.path.join(VOOM_IMAGES_DIR, name)
-        if os.path.isfile(path):
-            os.remove(path)
-
-
 def _extract_first_url(text):
     match = re.search(r"(https?://\S+)", text)
     if not match:
@@ -138,41 +264,6 @@ def _extract_notion_page_id(value):
     return f"{raw[0:8]}-{raw[8:12]}-{raw[12:16]}-{raw[16:20]}-{raw[20:32]}"
 
 
-def _notion_headers():
-    return {
-        "Authorization": f"Bearer {NOTION_TOKEN}",
-        "Notion-Version": NOTION_VERSION,
-        "Content-Type": "application/json",
-    }
-
-
-def _notion_request(method, url, payload):
-    for attempt in range(NOTION_MAX_RETRIES + 1):
-        resp = requests.request(
-            method,
-            url,
-            headers=_notion_headers(),
-            json=payload,
-            timeout=30,
-        )
-        if resp.status_code < 400:
-            return resp
-        if resp.status_code not in NOTION_RETRY_STATUSES:
-            return resp
-        if attempt >= NOTION_MAX_RETRIES:
-            return resp
-        retry_after = resp.headers.get("Retry-After")
-        if retry_after:
-            try:
-                delay = float(retry_after)
-            except ValueError:
-                delay = NOTION_RETRY_BASE_DELAY * (2 ** attempt)
-        else:
-            delay = NOTION_RETRY_BASE_DELAY * (2 ** attempt)
-        time.sleep(delay)
-    return resp
-
-
 def _format_exception(err):
     if err is None:
         return "未知錯誤"
@@ -283,7 +374,7 @@ def _text_blocks_from_content(content):
     return blocks
 
 
-def _create_notion_page(title, content, voom_url, parent_page):
+def _notion_parent_id(parent_page):
     if not NOTION_TOKEN:
         raise ValueError("NOTION_TOKEN 未設定")
     if not parent_page:
@@ -291,8 +382,11 @@ def _create_notion_page(title, content, voom_url, parent_page):
     parent_id = _extract_notion_page_id(parent_page)
     if not parent_id:
         raise ValueError("NOTION_PARENT_PAGE_URL/ID 未設定或格式不正確")
+    return parent_id
+
 
-    header_blocks = [
+def _notion_header_blocks(voom_url):
+    return [
         {
             "object": "block",
             "type": "paragraph",
@@ -313,9 +407,9 @@ def _create_notion_page(title, content, voom_url, parent_page):
         },
     ]
 
-    all_children = header_blocks + _text_blocks_from_content(content)
-    initial_children = all_children[:NOTION_BLOCK_LIMIT]
 
+def _post_notion_page(title, parent_page, children):
+    parent_id = _notion_parent_id(parent_page)
     payload = {
         "parent": {"page_id": parent_id},
         "properties": {
@@ -323,71 +417,241 @@ def _create_notion_page(title, content, voom_url, parent_page):
                 "title": [{"type": "text", "text": {"content": title}}],
             }
         },
-        "children": initial_children,
+        "children": children,
     }
 
-    resp = _notion_request(
-        "POST",
-        "https://api.notion.com/v1/pages",
-        payload,
-    )
+    resp = _notion.request("POST", "pages", payload)
     if resp.status_code >= 400:
         raise RuntimeError(f"Notion API 錯誤 {resp.status_code}: {resp.text}")
     data = resp.json()
-    page_id = data.get("id")
-    page_url = data.get("url")
+    return data.get("id"), data.get("url")
 
-    remaining = all_children[NOTION_BLOCK_LIMIT:]
+
+def _append_notion_blocks(page_id, blocks, on_appended=None):
+    """Append ``blocks`` in API-sized batches and return the created block ids.
+
+    ``on_appended(count, block_ids)`` is called after every batch with the
+    totals so far.
+    """
+    block_ids = []
+    remaining = blocks
     while remaining:
         batch = remaining[:NOTION_APPEND_BATCH_SIZE]
         remaining = remaining[NOTION_APPEND_BATCH_SIZE:]
-        append_resp = _notion_request(
+        append_resp = _notion.request(
             "PATCH",
-            f"https://api.notion.com/v1/blocks/{page_id}/children",
+            f"blocks/{page_id}/children",
             {"children": batch},
         )
         if append_resp.status_code >= 400:
             raise RuntimeError(
                 f"Notion API 錯誤 {append_resp.status_code}: {append_resp.text}"
             )
-
+        block_ids.extend(block.get("id") for block in append_resp.json().get("results", []))
+        if on_appended:
+            on_appended(len(blocks) - len(remaining), block_ids)
+    return block_ids
+
+
+def _create_notion_page(title, content, voom_url, parent_page, checkpoint=None):
+    all_children = _notion_header_blocks(voom_url) + _text_blocks_from_content(content)
+    page_id = checkpoint.get("page_id") if checkpoint else None
+    if page_id:
+        # Resuming: the page exists and holds the first ``appended`` blocks.
+        page_url = checkpoint.get("notion_url")
+        appended = checkpoint.get("appended", 0)
+    else:
+        page_id, page_url = _post_notion_page(
+            title,
+            parent_page,
+            all_children[:NOTION_BLOCK_LIMIT],
+        )
+        appended = min(len(all_children), NOTION_BLOCK_LIMIT)
+        if checkpoint:
+            checkpoint.page_created(page_id, page_url, appended)
+    def record_progress(count, _block_ids):
+        checkpoint.blocks_appended(appended + count)
+
+    _append_notion_blocks(
+        page_id,
+        all_children[appended:],
+        record_progress if checkpoint else None,
+    )
     return page_url
 
 
-def _download_voom_images(url):
-    _clear_voom_images()
-    cmd = [sys.executable, "voom_downloader.py", url]
-    return subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        timeout=180,
+class _NotionStreamWriter:
+    """Turns streamed Markdown into Notion blocks appended to an existing page.
+
+    Only complete lines are converted, so a heading or list item is never
+    split across appends. Pending blocks are flushed every
+    ``NOTION_STREAM_FLUSH_SECONDS`` or once a full append batch is ready.
+    ``on_flush`` receives the ids of every block written so far.
+    """
+
+    def __init__(self, page_id, block_ids=None, on_flush=None):
+        self.page_id = page_id
+        self.on_flush = on_flush
+        self._parts = []
+        self._buffer = ""
+        self._pending = []
+        self._block_ids = list(block_ids or [])
+        self._last_flush = time.monotonic()
+
+    @property
+    def text(self):
+        return "".join(self._parts).strip()
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        self._parts.append(chunk)
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            # A blank line still becomes an empty paragraph, as in _text_blocks_from_content.
+            self._pending.extend(_text_blocks_from_content(line or " "))
+        if (
+            len(self._pending) >= NOTION_APPEND_BATCH_SIZE
+            or time.monotonic() - self._last_flush >= NOTION_STREAM_FLUSH_SECONDS
+        ):
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._block_ids.extend(_append_notion_blocks(self.page_id, self._pending))
+            self._pending = []
+            if self.on_flush:
+                self.on_flush(self._block_ids)
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._buffer:
+            self._pending.extend(_text_blocks_from_content(self._buffer))
+            self._buffer = ""
+        self.flush()
+
+    def reset(self):
+        """Remove everything written so far, e.g. before a batched retry."""
+        self._pending = []
+        self._buffer = ""
+        self._parts = []
+        for block_id in self._block_ids:
+            resp = _notion.request("DELETE", f"blocks/{block_id}")
+            if resp.status_code >= 400:
+                logger.warning("Failed to delete Notion block %s: %s", block_id, resp.status_code)
+        self._block_ids = []
+        if self.on_flush:
+            self.on_flush(self._block_ids)
+
+
+def _new_workspace(job_id=None):
+    if VOOM_WORKSPACE_TTL_SECONDS > 0:
+        sweep_expired_workspaces(VOOM_IMAGES_DIR, VOOM_WORKSPACE_TTL_SECONDS)
+    return JobWorkspace(
+        VOOM_IMAGES_DIR,
+        job_id=job_id,
+        ttl_seconds=VOOM_WORKSPACE_TTL_SECONDS,
     )
 
 
-def _load_voom_images():
-    if not os.path.isdir(VOOM_IMAGES_DIR):
-        return []
-    files = [
-        os.path.join(VOOM_IMAGES_DIR, name)
-        for name in os.listdir(VOOM_IMAGES_DIR)
-        if os.path.isfile(os.path.join(VOOM_IMAGES_DIR, name))
-    ]
-    files.sort()
-    if MAX_VOOM_IMAGES is None:
-        return files
-    return files[:MAX_VOOM_IMAGES]
+def _download_voom_images(url, save_dir, on_image=None):
+    # The deadline is enforced inside the browser slot, from the moment the
+    # crawl starts; waiting here with a timeout would leave it running.
+    return _browser_pool.run(
+        lambda page: crawl_voom_images(
+            page, url, save_dir, on_image, timeout=VOOM_CRAWL_TIMEOUT_SECONDS
+        ),
+    )
 
 
-def _image_part(path):
+def _is_degraded():
+    job_usage = _current_usage.get()
+    return job_usage is not None and job_usage.degraded
+
+
+def _active_model():
+    return _degraded_model if _is_degraded() else model
+
+
+def _active_model_name():
+    return GEMINI_DEGRADED_MODEL if _is_degraded() else VISION_MODEL_NAME
+
+
+def _job_context():
+    return _current_usage.get(), _current_checkpoint.get()
+
+
+def _run_in_job(job_context, fn, *args):
+    # Worker threads do not inherit context vars; carry the job's usage and
+    # checkpoint over.
+    job_usage, checkpoint = job_context
+    usage_token = _current_usage.set(job_usage)
+    checkpoint_token = _current_checkpoint.set(checkpoint)
+    try:
+        return fn(*args)
+    finally:
+        _current_checkpoint.reset(checkpoint_token)
+        _current_usage.reset(usage_token)
+
+
+def _record_usage(usage_metadata):
+    if usage_metadata is None:
+        return
+    try:
+        _usage_ledger.record(_current_usage.get(), _active_model_name(), usage_metadata)
+    except Exception:
+        logger.exception("Failed to record Gemini token usage")
+
+
+def _record_timing(images, total_bytes, seconds, ok=True):
+    # The Gemini call is already paid for; a locked database must not fail the job.
+    try:
+        _analysis_planner.record(images, total_bytes, seconds, ok=ok, model_name=_active_model_name())
+    except Exception:
+        logger.exception("Failed to record Gemini timing")
+
+
+def _image_payload(path):
+    if _is_degraded() and _degraded_image_preprocessor.enabled:
+        return _degraded_image_preprocessor.prepare(
+            path,
+            digest=_cached_fingerprint(path)["sha256"],
+        )
+    if _image_preprocessor is not None:
+        return _image_preprocessor.prepare(
+            path,
+            digest=_cached_fingerprint(path)["sha256"],
+        )
     mime_type, _ = mimetypes.guess_type(path)
     if not mime_type:
         mime_type = "image/jpeg"
     with open(path, "rb") as f:
         data = f.read()
+    return mime_type, data
+
+
+def _image_part(path):
+    mime_type, data = _image_payload(path)
+    if _gemini_files is not None:
+        key = hashlib.sha256(data).hexdigest()
+        try:
+            return _gemini_files.get_or_upload(key, mime_type, data)
+        except Exception as e:
+            logger.warning("Gemini file upload failed, sending inline: %s", _format_exception(e))
     return {"mime_type": mime_type, "data": data}
 
 
+def _payload_size(path):
+    return len(_image_payload(path)[1])
+
+
+def _part_size(part):
+    if isinstance(part, dict):
+        return len(part["data"])
+    return getattr(part, "size_bytes", 0)
+
+
 def _analysis_prompt_template(mode):
     return after_hours_report_prompt if mode == "after_hours" else morning_report_prompt
 
@@ -440,6 +704,7 @@ def _extract_generation_text(response):
 
 
 def _generate_gemini_response(parts):
+    model = _active_model()
     request = model._prepare_request(contents=parts)
     if model._client is None:
         model._client = genai_client.get_default_generative_client()
@@ -447,10 +712,12 @@ def _generate_gemini_response(parts):
     last_err = None
     for attempt in range(GEMINI_MAX_RETRIES + 1):
         try:
+            _gemini_rate_limiter.acquire()
             raw_response = model._client.generate_content(
                 request=request,
                 timeout=GEMINI_TIMEOUT_SECONDS,
             )
+            _record_usage(raw_response.usage_metadata)
             return generation_types.GenerateContentResponse.from_response(raw_response)
         except (
             google_exceptions.DeadlineExceeded,
@@ -473,32 +740,151 @@ def _generate_gemini_response(parts):
     raise last_err
 
 
-def _analyze_voom_images_in_batches(image_paths, prompt_template, full_prompt):
-    batch_reports = []
-    for batch_number, (start_index, batch_paths) in enumerate(
-        _batched_image_paths(image_paths, GEMINI_IMAGE_BATCH_SIZE),
-        start=1,
-    ):
-        batch_prompt, batch_labels = _analysis_prompt(
-            prompt_template,
-            batch_paths,
-            start_index=start_index,
-        )
-        batch_prompt = (
-            f"{batch_prompt}\n\n"
-            "You are only receiving this subset of images from the same LINE VOOM post. "
-            "Analyze only these images and do not invent details from images that are not shown."
-        )
-        batch_parts = [batch_prompt]
-        for path in batch_paths:
-            batch_parts.append(_image_part(path))
-        batch_response = _generate_gemini_response(batch_parts)
-        batch_text = _extract_generation_text(batch_response)
-        batch_reports.append(
-            f"Batch {batch_number} ({', '.join(batch_labels)}):\n{batch_text}"
-        )
+def _stream_gemini_text(parts):
+    """Yield text chunks as Gemini streams them.
+
+    Failures before the first chunk are retried like ``_generate_gemini_response``;
+    once text has been yielded, errors propagate to the caller.
+    """
+    model = _active_model()
+    request = model._prepare_request(contents=parts)
+    if model._client is None:
+        model._client = genai_client.get_default_generative_client()
+
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        yielded = False
+        try:
+            _gemini_rate_limiter.acquire()
+            stream = model._client.stream_generate_content(
+                request=request,
+                timeout=GEMINI_TIMEOUT_SECONDS,
+            )
+            usage_metadata = None
+            for chunk in stream:
+                # The final chunk carries the cumulative token counts.
+                if chunk.usage_metadata:
+                    usage_metadata = chunk.usage_metadata
+                for cand in chunk.candidates[:1]:
+                    for part in cand.content.parts:
+                        if part.text:
+                            yielded = True
+                            yield part.text
+            _record_usage(usage_metadata)
+            return
+        except (
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.InternalServerError,
+            google_exceptions.ServiceUnavailable,
+        ) as err:
+            if yielded or attempt >= GEMINI_MAX_RETRIES:
+                raise
+            delay = GEMINI_RETRY_BASE_DELAY * (2 ** attempt)
+            logger.warning(
+                "Gemini stream failed with %s; retrying in %.1fs (%s/%s)",
+                type(err).__name__,
+                delay,
+                attempt + 1,
+                GEMINI_MAX_RETRIES,
+            )
+            time.sleep(delay)
+
+
+def _run_generation(parts, stream_to=None):
+    if stream_to is None:
+        return _extract_generation_text(_generate_gemini_response(parts))
+    chunks = []
+    for chunk in _stream_gemini_text(parts):
+        chunks.append(chunk)
+        stream_to.feed(chunk)
+    return "".join(chunks).strip()
+
+
+@lru_cache(maxsize=512)
+def _cached_fingerprint(path):
+    # Workspace paths are unique per job, so the path is a safe memo key.
+    return image_fingerprint(path)
+
+
+def _generate_image_analysis(prompt, image_paths, stream_to=None):
+    """Run one multimodal call, served from the image-hash cache when possible."""
+    cache_keys = []
+    if _analysis_cache:
+        fingerprints = [_cached_fingerprint(path) for path in image_paths]
+        cache_keys = AnalysisCache.keys_for(prompt, _active_model_name(), fingerprints)
+        cached_text = _analysis_cache.get(cache_keys)
+        if cached_text is not None:
+            logger.info("Analysis cache hit for %s images", len(image_paths))
+            if stream_to is not None:
+                stream_to.feed(cached_text)
+            return cached_text
+
+    parts = [prompt]
+    for path in image_paths:
+        parts.append(_image_part(path))
+    total_bytes = sum(_part_size(part) for part in parts[1:])
+    started = time.monotonic()
+    try:
+        text = _run_generation(parts, stream_to)
+    except google_exceptions.DeadlineExceeded:
+        _record_timing(len(image_paths), total_bytes, time.monotonic() - started, ok=False)
+        raise
+    _record_timing(len(image_paths), total_bytes, time.monotonic() - started)
+    if _analysis_cache and text:
+        _analysis_cache.put(cache_keys, text)
+    return text
+
+
+def _analyze_batch(prompt_template, batch_number, start_index, batch_paths):
+    checkpoint = _current_checkpoint.get()
+    batch_key = f"{start_index}+{len(batch_paths)}"
+    if checkpoint is not None:
+        report = checkpoint.batch_report(batch_key)
+        if report is not None:
+            logger.info("Batch %s restored from job checkpoint", batch_number)
+            return report
+    batch_prompt, batch_labels = _analysis_prompt(
+        prompt_template,
+        batch_paths,
+        start_index=start_index,
+    )
+    batch_prompt = (
+        f"{batch_prompt}\n\n"
+        "You are only receiving this subset of images from the same LINE VOOM post. "
+        "Analyze only these images and do not invent details from images that are not shown."
+    )
+    batch_text = _generate_image_analysis(batch_prompt, batch_paths)
+    report = f"Batch {batch_number} ({', '.join(batch_labels)}):\n{batch_text}"
+    if checkpoint is not None:
+        checkpoint.save_batch(batch_key, report)
+    return report
+
+
+def _analyze_voom_images_in_batches(image_paths, prompt_template, full_prompt, stream_to=None):
+    batches = list(_batched_image_paths(image_paths, GEMINI_IMAGE_BATCH_SIZE))
+    workers = min(GEMINI_BATCH_CONCURRENCY, len(batches))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini-batch") as executor:
+        futures = [
+            executor.submit(
+                _run_in_job,
+                _job_context(),
+                _analyze_batch,
+                prompt_template,
+                batch_number,
+                start_index,
+                batch_paths,
+            )
+            for batch_number, (start_index, batch_paths) in enumerate(batches, start=1)
+        ]
+        # Collect in submission order so the synthesis prompt keeps batch order.
+        batch_reports = [future.result() for future in futures]
 
+    return _synthesize_batch_reports(batch_reports, full_prompt, stream_to)
+
+
+def _synthesize_batch_reports(batch_reports, full_prompt, stream_to=None):
     if len(batch_reports) == 1:
+        if stream_to is not None:
+            stream_to.feed(batch_reports[0])
         return batch_reports[0]
 
     synthesis_prompt = (
@@ -510,31 +896,141 @@ def _analyze_voom_images_in_batches(image_paths, prompt_template, full_prompt):
         "Partial analyses:\n"
         f"{chr(10).join(batch_reports)}"
     )
-    synthesis_response = _generate_gemini_response([synthesis_prompt])
-    return _extract_generation_text(synthesis_response)
+    return _run_generation([synthesis_prompt], stream_to)
+
+
+class _PipelinedAnalysis:
+    """Starts Gemini batches while the crawler is still downloading.
+
+    ``on_image`` receives ``(path, idx)`` from the downloader with 1-based
+    slide indices. As soon as every image of the next batch has landed, that
+    batch is analyzed on a thread pool. The first batch waits until an image
+    beyond it arrives, so a post that fits in one batch is analyzed by
+    ``finish`` through the normal single-shot path. ``finish`` submits the
+    trailing partial batch once the crawl is done and synthesizes the
+    reports in batch order.
+    """
+
+    def __init__(self, prompt_template, batch_size=GEMINI_IMAGE_BATCH_SIZE, limit=None):
+        self.prompt_template = prompt_template
+        self.batch_size = batch_size
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._next_start = 1
+        # on_image runs on downloader threads, so capture the job's context here.
+        self._job_context = _job_context()
+        self._futures = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=GEMINI_BATCH_CONCURRENCY,
+            thread_name_prefix="gemini-pipeline",
+        )
 
+    def on_image(self, path, idx):
+        if self.limit is not None and idx > self.limit:
+            return
+        with self._lock:
+            self._paths[idx] = path
+            self._submit_ready(final=False)
+
+    def _submit(self, indices):
+        batch_paths = [self._paths[idx] for idx in indices]
+        batch_number = len(self._futures) + 1
+        logger.info("Pipelined batch %s started with images %s-%s", batch_number, indices[0], indices[-1])
+        self._futures.append(
+            self._executor.submit(
+                _run_in_job,
+                self._job_context,
+                _analyze_batch,
+                self.prompt_template,
+                batch_number,
+                indices[0] - 1,
+                batch_paths,
+            )
+        )
 
-def _analyze_voom_images_with_retry(image_paths, prompt_template):
+    def _submit_ready(self, final):
+        while True:
+            start = self._next_start
+            end = start + self.batch_size - 1
+            if self.limit is not None:
+                end = min(end, self.limit)
+            indices = [idx for idx in range(start, end + 1) if idx in self._paths]
+            if not indices:
+                return
+            complete = len(indices) == end - start + 1
+            if not (complete or final):
+                return
+            if not final and not self._futures and not any(idx > end for idx in self._paths):
+                # Hold the first batch until an image past it shows up: a post
+                # that fits in one batch goes through the single-shot path.
+                return
+            self._submit(indices)
+            self._next_start = indices[-1] + 1
+
+    def finish(self, image_paths, stream_to=None):
+        try:
+            with self._lock:
+                # Fetcher callbacks can trail the crawl's return; take any image
+                # that landed but has not been reported yet from the workspace.
+                for path in image_paths:
+                    stem = os.path.splitext(os.path.basename(path))[0]
+                    if stem.isdigit():
+                        self._paths.setdefault(int(stem), path)
+                single_batch = not self._futures and len(self._paths) <= self.batch_size
+                if not single_batch:
+                    self._submit_ready(final=True)
+            if single_batch:
+                self._executor.shutdown(wait=True)
+                return analyze_voom_images(image_paths, self.prompt_template, stream_to=stream_to)
+            batch_reports = [future.result() for future in self._futures]
+        except Exception:
+            self.cancel()
+            raise
+        self._executor.shutdown(wait=True)
+        if not batch_reports:
+            raise RuntimeError("找不到圖片，無法分析 VOOM 貼文。")
+        full_prompt, _ = _analysis_prompt(self.prompt_template, image_paths)
+        return _synthesize_batch_reports(batch_reports, full_prompt, stream_to)
+
+    def cancel(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _analyze_voom_images_with_retry(image_paths, prompt_template, stream_to=None):
     if not image_paths:
         return "No VOOM images found."
 
     prompt, _ = _analysis_prompt(prompt_template, image_paths)
-    parts = [prompt]
-    for path in image_paths:
-        parts.append(_image_part(path))
+
+    can_batch = len(image_paths) > 1 and GEMINI_IMAGE_BATCH_SIZE < len(image_paths)
+    if can_batch:
+        # Plan on the bytes Gemini will actually receive, which is what the
+        # planner records; prepared payloads are cached per hash anyway.
+        total_bytes = sum(_payload_size(path) for path in image_paths)
+        plan = _analysis_planner.plan(len(image_paths), total_bytes, _active_model_name())
+        if plan == analysis_planner.BATCHED:
+            logger.info(
+                "Planning %s images (%s bytes) as batches of %s",
+                len(image_paths),
+                total_bytes,
+                GEMINI_IMAGE_BATCH_SIZE,
+            )
+            return _analyze_voom_images_in_batches(image_paths, prompt_template, prompt, stream_to)
 
     try:
-        response = _generate_gemini_response(parts)
-        return _extract_generation_text(response)
+        return _generate_image_analysis(prompt, image_paths, stream_to)
     except google_exceptions.DeadlineExceeded:
-        if len(image_paths) <= 1 or GEMINI_IMAGE_BATCH_SIZE >= len(image_paths):
+        if not can_batch:
             raise
         logger.warning(
             "Gemini timed out for %s images; falling back to batches of %s",
             len(image_paths),
             GEMINI_IMAGE_BATCH_SIZE,
         )
-        return _analyze_voom_images_in_batches(image_paths, prompt_template, prompt)
+        if stream_to is not None:
+            stream_to.reset()
+        return _analyze_voom_images_in_batches(image_paths, prompt_template, prompt, stream_to)
 
 
 def analyze_voom_images(image_paths, prompt_template):
@@ -639,36 +1135,420 @@ def _reply_with_optional_push(reply_token, target_id, text):
             )
 
 
-def _process_voom_sync(url, mode):
-    result = _download_voom_images(url)
-    if result.returncode != 0:
-        raise RuntimeError(
-            "下載 VOOM 圖片失敗。\n"
-            f"錯誤訊息：{(result.stderr or result.stdout).strip()}"
-        )
-    images = _load_voom_images()
-    if not images:
-        raise RuntimeError("找不到圖片，無法分析 VOOM 貼文。")
+def _result_cache_key(url, mode):
+    prompt_template = _analysis_prompt_template(mode)
+    return (voom_post_id(url), mode, prompt_version(prompt_template), _active_model_name())
+
+
+def _stream_analysis_to_notion(url, mode, analyze, on_page_created=None, checkpoint=None):
+    page_id = checkpoint.get("page_id") if checkpoint else None
+    if page_id:
+        notion_url = checkpoint.get("notion_url")
+    else:
+        analyzed_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+        title = _analysis_title(mode, analyzed_at)
+        parent_page = _analysis_parent_page(mode)
+        page_id, notion_url = _post_notion_page(title, parent_page, _notion_header_blocks(url))
+        if checkpoint:
+            checkpoint.page_created(page_id, notion_url)
+    if on_page_created:
+        # The announcement is best effort; the analysis goes on without it.
+        try:
+            on_page_created(notion_url)
+        except Exception:
+            logger.exception("Failed to announce Notion page %s", notion_url)
+
+    writer = _NotionStreamWriter(
+        page_id,
+        block_ids=checkpoint.get("block_ids") if checkpoint else None,
+        on_flush=(lambda ids: checkpoint.blocks_appended(len(ids), ids)) if checkpoint else None,
+    )
+    if checkpoint and checkpoint.get("block_ids"):
+        # A resumed page holds whatever was streamed before the crash.
+        writer.reset()
+    try:
+        analyze(writer)
+        writer.close()
+    except Exception as e:
+        writer.close()
+        _append_notion_blocks(page_id, _text_blocks_from_content(f"❌ 分析失敗：{_format_exception(e)}"))
+        raise
+    return notion_url
 
-    prompt = _analysis_prompt_template(mode)
-    analysis_text = analyze_voom_images(images, prompt)
 
+def _publish_analysis(url, mode, analysis_text, checkpoint=None):
     analyzed_at = datetime.now().strftime("%Y-%m-%d %H:%M")
     title = _analysis_title(mode, analyzed_at)
     parent_page = _analysis_parent_page(mode)
-    notion_url = _create_notion_page(title, analysis_text, url, parent_page)
+    return _create_notion_page(title, analysis_text, url, parent_page, checkpoint)
+
+
+def _checkpointed_images(workspace, checkpoint):
+    """Images saved by a resumed job's crawl, or None if it has to crawl again."""
+    if checkpoint is None or checkpoint.stage == checkpoints.QUEUED:
+        return None
+    names = checkpoint.get("images") or []
+    paths = [os.path.join(workspace.path, name) for name in names]
+    if paths and all(os.path.isfile(path) for path in paths):
+        logger.info("Job %s resumes with %s crawled images", checkpoint.job_id, len(paths))
+        return paths
+    logger.info("Crawled images of job %s are gone; crawling again", checkpoint.job_id)
+    return None
+
+
+def _cached_notion_url(url, mode):
+    if not _result_cache:
+        return None
+    cache_key = _result_cache_key(url, mode)
+    notion_url = _result_cache.get(*cache_key)
+    if notion_url:
+        logger.info("Result cache hit for VOOM post %s (%s)", cache_key[0], mode)
+    return notion_url
+
+
+def _process_voom_sync(url, mode, job_id=None, on_page_created=None, checkpoint=None):
+    cache_key = _result_cache_key(url, mode)
+    # Checked again here for jobs queued before the result was cached.
+    cached_url = _cached_notion_url(url, mode)
+    if cached_url:
+        return cached_url
+    if checkpoint and checkpoint.stage == checkpoints.PUBLISHED:
+        return checkpoint.get("notion_url")
+
+    analysis_text = checkpoint.get("analysis") if checkpoint else None
+    if analysis_text is not None:
+        logger.info("Job %s resumes after analysis", checkpoint.job_id)
+        if GEMINI_STREAM:
+            notion_url = _stream_analysis_to_notion(
+                url,
+                mode,
+                lambda writer: writer.feed(analysis_text),
+                on_page_created,
+                checkpoint,
+            )
+        else:
+            notion_url = _publish_analysis(url, mode, analysis_text, checkpoint)
+        checkpoint.published(notion_url)
+        if _result_cache and notion_url:
+            _result_cache.put(*cache_key, notion_url)
+        return notion_url
+
+    prompt = _analysis_prompt_template(mode)
+    with _new_workspace(job_id) as workspace:
+        images = _checkpointed_images(workspace, checkpoint)
+        pipeline = None
+        if images is None:
+            pipeline = _PipelinedAnalysis(prompt, limit=MAX_VOOM_IMAGES) if GEMINI_PIPELINE else None
+            try:
+                _download_voom_images(
+                    url,
+                    workspace.path,
+                    on_image=pipeline.on_image if pipeline else None,
+                )
+            except Exception as e:
+                if pipeline:
+                    pipeline.cancel()
+                raise RuntimeError(
+                    "下載 VOOM 圖片失敗。\n"
+                    f"錯誤訊息：{_format_exception(e)}"
+                ) from e
+            images = workspace.image_paths(limit=MAX_VOOM_IMAGES)
+            if not images:
+                if pipeline:
+                    pipeline.cancel()
+                raise RuntimeError("找不到圖片，無法分析 VOOM 貼文。")
+            if checkpoint:
+                checkpoint.crawled(os.path.basename(path) for path in images)
+
+        def analyze(stream_to=None):
+            if pipeline:
+                text = pipeline.finish(images, stream_to)
+            else:
+                text = analyze_voom_images(images, prompt, stream_to=stream_to)
+            if checkpoint:
+                checkpoint.analyzed(text)
+            return text
+
+        if GEMINI_STREAM:
+            notion_url = _stream_analysis_to_notion(url, mode, analyze, on_page_created, checkpoint)
+        else:
+            analysis_text = analyze()
+
+    if not GEMINI_STREAM:
+        notion_url = _publish_analysis(url, mode, analysis_text, checkpoint)
+    if checkpoint:
+        checkpoint.published(notion_url)
+    if _result_cache and notion_url:
+        _result_cache.put(*cache_key, notion_url)
     return notion_url
 
 
-def process_voom_background(url, mode, target_id):
+def _budget_reply_text(status):
+    if status == usage.USER_EXCEEDED:
+        return "⛔ 你今天的 Gemini 用量已達上限，請明天再試"
+    return "⛔ 今天的 Gemini 用量已達上限，請明天再試"
+
+
+def process_voom_background(url, mode, flight_key, user_key=None, checkpoint=None):
+    """Run one VOOM job and notify every target that joined it while in flight."""
+    if checkpoint is None:
+        _run_voom_job(url, mode, flight_key, user_key, None)
+        return
+    # The lease is taken here, when a worker starts the job, not at enqueue.
+    if not checkpoint.acquire():
+        checkpoint.stop()
+        logger.warning("Job %s is leased by another worker; skipping", checkpoint.job_id)
+        return
     try:
-        _push_text(target_id, "🔍 正在分析 VOOM 圖片…")
-        notion_url = _process_voom_sync(url, mode)
-        _push_text(target_id, f"✅ 分析完成\n{notion_url}")
+        _run_voom_job(url, mode, flight_key, user_key, checkpoint)
+    finally:
+        checkpoint.stop()
+
+
+def _run_voom_job(url, mode, flight_key, user_key, checkpoint):
+    budget = _usage_ledger.budget_status(user_key)
+    if budget != usage.OK and GEMINI_BUDGET_ACTION != "degrade":
+        try:
+            _push_to_targets(_finish_targets(flight_key, checkpoint), _budget_reply_text(budget))
+        finally:
+            if checkpoint:
+                checkpoint.complete()
+        return
+    job_usage = usage.JobUsage(
+        user_key,
+        mode,
+        job_id=checkpoint.job_id if checkpoint else None,
+        degraded=budget != usage.OK,
+    )
+    if job_usage.degraded:
+        logger.info("Token budget %s for %s; running degraded", budget, user_key)
+    usage_token = _current_usage.set(job_usage)
+    checkpoint_token = _current_checkpoint.set(checkpoint)
+    try:
+        _process_voom_job(url, mode, flight_key, checkpoint)
+    finally:
+        _current_checkpoint.reset(checkpoint_token)
+        _current_usage.reset(usage_token)
+    logger.info(
+        "Job %s used %s tokens (%s in / %s out) over %s calls",
+        job_usage.job_id,
+        job_usage.total_tokens,
+        job_usage.prompt_tokens,
+        job_usage.output_tokens,
+        job_usage.calls,
+    )
+
+
+def _job_targets(flight_key, checkpoint):
+    # A resumed job whose flight expired still knows who asked for it.
+    waiters = _inflight.waiters(flight_key)
+    if waiters or checkpoint is None:
+        return waiters
+    return checkpoint.get("targets", [])
+
+
+def _finish_targets(flight_key, checkpoint):
+    waiters = _inflight.finish(flight_key)
+    if waiters or checkpoint is None:
+        return waiters
+    return checkpoint.get("targets", [])
+
+
+def _push_to_targets(targets, text):
+    # One waiter who blocked the bot (or an exhausted push quota) must not
+    # stop the job or the notices to everyone else.
+    for target_id in targets:
+        try:
+            _push_text(target_id, text)
+        except Exception:
+            logger.exception("Failed to push VOOM notice to %s", target_id)
+
+
+def _process_voom_job(url, mode, flight_key, checkpoint=None):
+    if checkpoint is not None and checkpoint.resumed:
+        status_text = "🔄 服務已重新啟動，繼續先前的 VOOM 分析…"
+    else:
+        status_text = "🔍 正在分析 VOOM 圖片…"
+    def announce_page(notion_url):
+        _push_to_targets(
+            _job_targets(flight_key, checkpoint),
+            f"📝 分析進行中，內容會陸續寫入：\n{notion_url}",
+        )
+
+    message = "❌ 分析失敗：服務內部錯誤"
+    try:
+        _push_to_targets(_job_targets(flight_key, checkpoint), status_text)
+        notion_url = _process_voom_sync(
+            url,
+            mode,
+            job_id=checkpoint.job_id if checkpoint else None,
+            on_page_created=announce_page,
+            checkpoint=checkpoint,
+        )
+        message = f"✅ 分析完成\n{notion_url}"
     except Exception as e:
         err_msg = _format_exception(e)
         print(f"[error] {err_msg}\n{traceback.format_exc()}", flush=True)
-        _push_text(target_id, f"❌ 分析失敗：{err_msg}")
+        message = f"❌ 分析失敗：{err_msg}"
+    finally:
+        # Always end the flight and the job record, or later shares of the
+        # post coalesce onto a job that never reports back.
+        try:
+            _push_to_targets(_finish_targets(flight_key, checkpoint), message)
+        finally:
+            if checkpoint:
+                checkpoint.complete()
+
+
+def _enqueue_voom(url, mode, target_id, user_key):
+    if GEMINI_BUDGET_ACTION != "degrade":
+        budget = _usage_ledger.budget_status(user_key)
+        if budget != usage.OK:
+            return budget, 0
+    flight_key = (voom_post_id(url), mode)
+
+    def start():
+        checkpoint = checkpoints.JobCheckpoint.create(
+            _store,
+            lease_seconds=VOOM_JOB_LEASE_SECONDS,
+            url=url,
+            mode=mode,
+            flight_key=list(flight_key),
+            user_key=user_key,
+            targets=[target_id],
+        )
+        result = _job_scheduler.submit(
+            user_key,
+            process_voom_background,
+            url,
+            mode,
+            flight_key,
+            user_key,
+            checkpoint,
+        )
+        if result[0] != job_queue.ACCEPTED:
+            checkpoint.complete()
+        return result
+
+    return _inflight.join(flight_key, target_id, start)
+
+
+def _resume_orphaned_jobs():
+    """Requeue jobs left unfinished by a crashed or restarted worker."""
+    resumed = checkpoints.claim_orphaned(_store, lease_seconds=VOOM_JOB_LEASE_SECONDS)
+    for checkpoint in resumed:
+        logger.info("Resuming job %s from stage %s", checkpoint.job_id, checkpoint.stage)
+    with _resume_lock:
+        _unqueued_resumes.extend(resumed)
+    _submit_resumed_jobs()
+    return resumed
+
+
+def _submit_resumed_jobs():
+    """Queue claimed jobs; those that do not fit stay claimed for the next try."""
+    with _resume_lock:
+        pending = list(_unqueued_resumes)
+        _unqueued_resumes.clear()
+    left = []
+    for checkpoint in pending:
+        # Count resumed jobs on their own key so a stale per-user count left
+        # by the dead worker cannot block them.
+        try:
+            status, _ = _job_scheduler.submit(
+                f"resume:{checkpoint.job_id}",
+                process_voom_background,
+                checkpoint.get("url"),
+                checkpoint.get("mode"),
+                tuple(checkpoint.get("flight_key")),
+                checkpoint.get("user_key"),
+                checkpoint,
+            )
+        except Exception:
+            logger.exception("Failed to requeue job %s", checkpoint.job_id)
+            status = None
+        if status != job_queue.ACCEPTED:
+            # This process owns the job now and its heartbeat keeps it that
+            # way, so nobody else will pick it up: retry from _housekeeping.
+            logger.warning("Could not requeue job %s (%s); will retry", checkpoint.job_id, status)
+            left.append(checkpoint)
+    with _resume_lock:
+        _unqueued_resumes.extend(left)
+
+
+def _submit_reply_text(status, position):
+    if status in (usage.USER_EXCEEDED, usage.DAILY_EXCEEDED):
+        return _budget_reply_text(status)
+    if status == job_queue.COALESCED:
+        return "📥 這篇 VOOM 已在分析中，完成後會一起通知你"
+    if status == job_queue.ACCEPTED:
+        if position:
+            return f"📥 已收到 VOOM，目前排隊第 {position} 位，完成後會通知你"
+        return "📥 已收到 VOOM，開始分析，完成後會通知你"
+    if status == job_queue.USER_LIMIT:
+        return f"⏳ 你已有 {position} 則 VOOM 正在處理，請等完成後再送出"
+    if status == job_queue.QUEUE_FULL:
+        return f"⏳ 目前排隊已滿（{position} 則等待中），請稍後再試"
+    return "⏳ 服務正在重新啟動，請稍後再試"
+
+
+@app.on_event("startup")
+def _on_startup():
+    _store.purge_expired()
+    _browser_pool.start()
+    _job_scheduler.start()
+    resumed = _resume_orphaned_jobs()
+    # Keep the crawled images of resumed jobs; sweep the rest.
+    sweep_expired_workspaces(
+        VOOM_IMAGES_DIR,
+        VOOM_WORKSPACE_TTL_SECONDS,
+        include_active=True,
+        keep={checkpoint.job_id for checkpoint in resumed},
+    )
+    _event_spool.start()
+    threading.Thread(target=_housekeeping, name="store-purge", daemon=True).start()
+
+
+def _housekeeping():
+    """Drop expired store entries and old spooled events while the app runs.
+
+    Also retries queueing resumed jobs that did not fit at startup.
+    """
+    while not _housekeeping_stop.wait(STORE_PURGE_INTERVAL_SECONDS):
+        try:
+            _store.purge_expired()
+            _event_spool.purge_done()
+        except Exception:
+            logger.exception("Periodic store purge failed")
+        try:
+            _submit_resumed_jobs()
+        except Exception:
+            logger.exception("Failed to requeue resumed jobs")
+
+
+@app.on_event("shutdown")
+def _on_shutdown():
+    _housekeeping_stop.set()
+    # Stop taking spooled events; anything left stays pending for the next start.
+    _event_spool.shutdown(timeout=30)
+    # Let queued and in-flight jobs finish before the browsers go away.
+    _job_scheduler.shutdown(timeout=VOOM_SHUTDOWN_TIMEOUT_SECONDS)
+    _browser_pool.shutdown()
+    _notion.close()
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "queue": _job_scheduler.stats(),
+        "inflight_posts": len(_inflight),
+        "webhook_spool": _event_spool.stats(),
+        "webhook_idempotency": _idempotency.stats(),
+        "result_cache": _result_cache.stats() if _result_cache else None,
+        "analysis_cache": _analysis_cache.stats() if _analysis_cache else None,
+        "gemini_files": _gemini_files.stats() if _gemini_files else None,
+        "notion": _notion.stats(),
+        "token_usage": _usage_ledger.summary(),
+    }
 
 
 @app.post("/callback")
@@ -680,11 +1560,13 @@ async def callback(request: Request):
     body = body_bytes.decode("utf-8")
     logger.info("Request body: %s", body)
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    # Verify here, then spool the raw body and acknowledge right away; the
+    # spool workers run the handlers so LINE never waits on the pipeline.
+    if not handler.parser.signature_validator.validate(body, signature):
         logger.warning("Invalid signature. Please check your channel secret.")
         raise HTTPException(status_code=400, detail="Invalid signature.")
+    # The spool write can wait on the SQLite lock held by another worker.
+    await run_in_threadpool(_event_spool.append, body, signature)
 
     return PlainTextResponse("OK")
 
@@ -692,6 +1574,37 @@ async def callback(request: Request):
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
     """Handle incoming text messages."""
+    keys = _event_idempotency_keys(event)
+    if not _idempotency.claim(keys):
+        delivery = getattr(event, "delivery_context", None)
+        logger.info(
+            "Skipping duplicate webhook event %s (redelivery=%s)",
+            getattr(event, "webhook_event_id", None),
+            getattr(delivery, "is_redelivery", None),
+        )
+        return
+    try:
+        _handle_text_message(event)
+    except Exception:
+        # Nothing was queued (replies after an enqueue never raise), so let
+        # the spool retry this event instead of treating it as handled.
+        _idempotency.release(keys)
+        raise
+    _idempotency.done(keys)
+
+
+def _event_idempotency_keys(event):
+    keys = []
+    event_id = getattr(event, "webhook_event_id", None)
+    if event_id:
+        keys.append(f"event:{event_id}")
+    message_id = getattr(event.message, "id", None)
+    if message_id:
+        keys.append(f"message:{message_id}")
+    return keys
+
+
+def _handle_text_message(event):
     user_message = event.message.text.strip()
     print(f"[debug] User message raw: {event.message.text!r}", flush=True)
     print(f"[debug] User message stripped: {user_message!r}", flush=True)
@@ -715,24 +1628,38 @@ def handle_message(event):
         _reply_with_optional_push(event.reply_token, target_id, reply_text)
         return
 
+    # A cached post costs no tokens, queue slot or push: answer it right away.
+    cached_url = _cached_notion_url(url, mode)
+    if cached_url:
+        _reply_with_optional_push(event.reply_token, target_id, f"✅ 分析完成\n{cached_url}")
+        return
+
     if target_id:
-        reply_text = "📥 已收到 VOOM，開始分析，完成後會通知你"
-        _reply_with_optional_push(event.reply_token, target_id, reply_text)
-        threading.Thread(
-            target=process_voom_background,
-            args=(url, mode, target_id),
-            daemon=True,
-        ).start()
+        user_key = getattr(source, "user_id", None) or target_id
+        status, position = _enqueue_voom(url, mode, target_id, user_key)
+        # The job is queued now; a failed reply must not make the event retry.
+        try:
+            _reply_with_optional_push(
+                event.reply_token,
+                target_id,
+                _submit_reply_text(status, position),
+            )
+        except Exception:
+            logger.exception("Failed to reply to %s after queueing %s", target_id, url)
         return
 
     # Fallback: no target_id, process synchronously and reply once
     try:
         notion_url = _process_voom_sync(url, mode)
-        _reply_with_optional_push(event.reply_token, None, f"已建立 Notion 頁面：{notion_url}")
+        reply_text = f"已建立 Notion 頁面：{notion_url}"
     except Exception as e:
         err_msg = _format_exception(e)
         print(f"[error] {err_msg}\n{traceback.format_exc()}", flush=True)
-        _reply_with_optional_push(event.reply_token, None, f"處理失敗：{err_msg}")
+        reply_text = f"處理失敗：{err_msg}"
+    try:
+        _reply_with_optional_push(event.reply_token, None, reply_text)
+    except Exception:
+        logger.exception("Failed to reply after processing %s", url)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""Compare Gemini latency and output for raw vs preprocessed images.
+
+    python bench_image_prep.py <圖片目錄> [--max-dim 1024 1600 2048] [--quality 80 90] [--gemini]
+
+Without ``--gemini`` only preprocessing time and payload size are measured.
+With it, each setting is also sent to GEMINI_VISION_MODEL once and the
+latency plus the response text are printed so chart-text legibility can be
+compared side by side.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from image_utils import ImagePreprocessor, _raw_image
+
+
+def _image_files(directory):
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+    )
+
+
+def _ask_gemini(model, parts):
+    started = time.perf_counter()
+    response = model.generate_content(parts)
+    return time.perf_counter() - started, response.text.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--max-dim", type=int, nargs="+", default=[1024, 1600, 2048])
+    parser.add_argument("--quality", type=int, nargs="+", default=[80, 90])
+    parser.add_argument("--format", default="webp", choices=["webp", "jpeg"])
+    parser.add_argument("--gemini", action="store_true", help="also time a Gemini call per setting")
+    args = parser.parse_args()
+
+    paths = _image_files(args.directory)
+    if not paths:
+        parser.error("目錄中沒有圖片")
+
+    settings = [("raw", None)]
+    for max_dim in args.max_dim:
+        for quality in args.quality:
+            settings.append((f"{args.format} {max_dim}px q{quality}", (max_dim, quality)))
+
+    model = None
+    if args.gemini:
+        from dotenv import load_dotenv
+        import google.generativeai as genai
+
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        model = genai.GenerativeModel(os.getenv("GEMINI_VISION_MODEL", "gemini-2.5-flash"))
+
+    prompt = "逐張列出圖片中的所有文字與數字，保持原本順序。"
+    cache_dir = tempfile.mkdtemp(prefix="voom_prep_bench_")
+    try:
+        print(f"{'setting':24} {'prep':>8} {'bytes':>12} {'gemini':>9}")
+        for name, params in settings:
+            started = time.perf_counter()
+            if params is None:
+                images = [_raw_image(path) for path in paths]
+            else:
+                max_dim, quality = params
+                prep = ImagePreprocessor(cache_dir, max_dim=max_dim, fmt=args.format, quality=quality)
+                images = [prep.prepare(path) for path in paths]
+            prep_seconds = time.perf_counter() - started
+            total = sum(len(data) for _, data in images)
+            latency_text = "-"
+            answer = None
+            if model is not None:
+                parts = [prompt] + [{"mime_type": mime, "data": data} for mime, data in images]
+                latency, answer = _ask_gemini(model, parts)
+                latency_text = f"{latency:.1f} s"
+            print(f"{name:24} {prep_seconds:>6.2f} s {total:>12,} {latency_text:>9}")
+            if answer:
+                print(f"--- {name} ---\n{answer}\n")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
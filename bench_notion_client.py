@@ -0,0 +1,147 @@
+"""Compare per-request Notion call latency with and without connection pooling.
+
+    python bench_notion_client.py [--requests 200] [--concurrency 1 4] [--connect-delay-ms 30]
+
+Runs a local stand-in for api.notion.com (HTTP/1.1 keep-alive) and sends
+block-append PATCH calls through a new connection per call
+(``requests.request``, the old behaviour) and through ``NotionClient``.
+``--connect-delay-ms`` makes the server stall on every new connection to
+mimic the TCP+TLS handshake to the real API; ``--handler-ms`` adds
+per-request server time. HTTP/2 needs TLS, so the httpx transport is timed
+over HTTP/1.1 here.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import socket
+import statistics
+import threading
+import time
+
+import requests
+
+from notion_client import NotionClient, _httpx_http2
+
+
+def _make_handler(connect_delay, handler_delay, connections):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # Headers and body go out in separate writes; without NODELAY
+            # Nagle + delayed ACK adds ~40 ms to every keep-alive response.
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with connections["lock"]:
+                connections["count"] += 1
+            time.sleep(connect_delay)
+
+        def _respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            time.sleep(handler_delay)
+            body = json.dumps({"object": "list", "results": [{"id": "stand-in"}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_PATCH = _respond
+        do_POST = _respond
+        do_DELETE = _respond
+
+        def log_message(self, *args):
+            pass
+
+    return StandInHandler
+
+
+def _unpooled(base_url):
+    def call(payload):
+        return requests.request(
+            "PATCH",
+            f"{base_url}/blocks/stand-in/children",
+            headers={
+                "Authorization": "Bearer bench",
+                "Notion-Version": "2022-06-28",
+                "Content-Type": "application/json",
+            },
+            json=payload,
+            timeout=30,
+        )
+
+    return call, None
+
+
+def _pooled(base_url, pool_size, http2):
+    client = NotionClient("bench", base_url=base_url, pool_size=pool_size, http2=http2)
+
+    def call(payload):
+        return client.request("PATCH", "blocks/stand-in/children", payload)
+
+    return call, client
+
+
+def _run(call, total, concurrency):
+    payload = {"children": [{"object": "block", "type": "paragraph", "paragraph": {"rich_text": []}}]}
+
+    def timed(_):
+        started = time.perf_counter()
+        resp = call(payload)
+        resp.json()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, range(total)))
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--connect-delay-ms", type=float, default=30.0)
+    parser.add_argument("--handler-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    connections = {"count": 0, "lock": threading.Lock()}
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        _make_handler(args.connect_delay_ms / 1000, args.handler_ms / 1000, connections),
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    variants = [("requests.request（每次新連線）", lambda c: _unpooled(base_url))]
+    variants.append(("NotionClient requests.Session", lambda c: _pooled(base_url, c, http2=False)))
+    if _httpx_http2() is not None:
+        variants.append(("NotionClient httpx", lambda c: _pooled(base_url, c, http2=True)))
+
+    print(f"{'設定':<34}{'並行':>4}{'平均 ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>9}{'連線數':>8}")
+    for concurrency in args.concurrency:
+        for name, build in variants:
+            call, client = build(concurrency)
+            with connections["lock"]:
+                connections["count"] = 0
+            latencies, elapsed = _run(call, args.requests, concurrency)
+            if client is not None:
+                client.close()
+            ms = sorted(value * 1000 for value in latencies)
+            print(
+                f"{name:<34}{concurrency:>4}"
+                f"{statistics.mean(ms):>10.2f}"
+                f"{statistics.median(ms):>10.2f}"
+                f"{ms[int(len(ms) * 0.95) - 1]:>10.2f}"
+                f"{len(ms) / elapsed:>9.1f}"
+                f"{connections['count']:>8}"
+            )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
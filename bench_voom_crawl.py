@@ -0,0 +1,112 @@
+"""Compare VOOM crawl wall time and browser memory across launch configurations.
+
+    python bench_voom_crawl.py <VOOM 文章網址> [--runs 3] [--include-headed]
+
+Memory is the peak RSS of the Chromium process tree, sampled every 100 ms;
+it needs ``psutil`` (``pip install psutil``) and is reported as n/a otherwise.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from playwright.sync_api import sync_playwright
+
+import voom_downloader
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+CONFIGS = [
+    ("headless", {"headless": True, "chromium_args": ""}),
+    ("headless + --disable-gpu", {"headless": True, "chromium_args": "--disable-gpu --disable-dev-shm-usage"}),
+    ("headless + --single-process", {"headless": True, "chromium_args": "--disable-gpu --single-process --no-zygote"}),
+]
+HEADED_CONFIG = ("headed", {"headless": False, "chromium_args": ""})
+
+
+class _TreeMemorySampler:
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _tree_rss(self):
+        root = psutil.Process(os.getpid())
+        total = 0
+        for proc in root.children(recursive=True):
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                continue
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._tree_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if psutil:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if psutil:
+            self._thread.join()
+        return False
+
+
+def _crawl_once(playwright, url, options):
+    save_dir = tempfile.mkdtemp(prefix="voom_bench_")
+    try:
+        with _TreeMemorySampler() as sampler:
+            started = time.perf_counter()
+            browser = playwright.chromium.launch(**voom_downloader.launch_options(**options))
+            context = browser.new_context(**voom_downloader.context_options())
+            page = context.new_page()
+            paths = voom_downloader.crawl_voom_images(page, url, save_dir)
+            browser.close()
+            elapsed = time.perf_counter() - started
+        return elapsed, sampler.peak, len(paths)
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--include-headed", action="store_true", help="also run headed (needs a display)")
+    args = parser.parse_args()
+
+    configs = list(CONFIGS)
+    if args.include_headed:
+        configs.insert(0, HEADED_CONFIG)
+
+    rows = []
+    with sync_playwright() as playwright:
+        for name, options in configs:
+            times, peaks, counts = [], [], []
+            for _ in range(args.runs):
+                elapsed, peak, count = _crawl_once(playwright, args.url, options)
+                times.append(elapsed)
+                peaks.append(peak)
+                counts.append(count)
+            rows.append((name, statistics.median(times), max(peaks), counts[-1]))
+
+    print(f"\n{'config':32} {'median wall':>12} {'peak RSS':>12} {'images':>7}")
+    for name, wall, peak, count in rows:
+        peak_text = f"{peak / 1024 / 1024:.0f} MiB" if psutil else "n/a"
+        print(f"{name:32} {wall:>10.2f} s {peak_text:>12} {count:>7}")
+
+
+if __name__ == "__main__":
+    main()
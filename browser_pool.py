@@ -0,0 +1,151 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from playwright.sync_api import sync_playwright
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BrowserPool:
+    """Keeps headless Chromium browsers warm and hands a fresh page to each job.
+
+    Playwright's sync API is bound to the thread that started it, so every
+    pool slot is a dedicated thread that owns its own Playwright driver,
+    browser and context. Jobs are callables ``fn(page)`` submitted through
+    ``submit``; each runs on a new page of a reused context, and the context
+    is recycled after ``recycle_after`` jobs. A browser that disconnected or
+    crashed is replaced before the next job runs on that slot, and so is the
+    browser of a job that raised ``TimeoutError``: jobs enforce their own
+    deadline on the slot thread, and a page that timed out may be wedged.
+    """
+
+    def __init__(self, size=1, recycle_after=20, launch_options=None, context_options=None):
+        self.size = max(1, size)
+        self.recycle_after = max(1, recycle_after)
+        self.launch_options = dict(launch_options or {"headless": True})
+        self.context_options = dict(context_options or {})
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+
+    def start(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("瀏覽器池已關閉")
+            if self._started:
+                return
+            for slot in range(self.size):
+                thread = threading.Thread(
+                    target=self._run_slot,
+                    args=(slot,),
+                    name=f"browser-pool-{slot}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def submit(self, fn):
+        self.start()
+        future = Future()
+        self._jobs.put((fn, future))
+        return future
+
+    def run(self, fn, timeout=None):
+        return self.submit(fn).result(timeout=timeout)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if not self._started:
+                self._closed = True
+                return
+            for _ in self._threads:
+                self._jobs.put(_STOP)
+            threads = list(self._threads)
+            self._threads = []
+            self._started = False
+            self._closed = True
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _launch(self, playwright):
+        browser = playwright.chromium.launch(**self.launch_options)
+        return browser, browser.new_context(**self.context_options)
+
+    def _close_quietly(self, obj):
+        if obj is None:
+            return
+        try:
+            obj.close()
+        except Exception:
+            pass
+
+    def _healthy(self, browser):
+        try:
+            return browser is not None and browser.is_connected()
+        except Exception:
+            return False
+
+    def _run_slot(self, slot):
+        with sync_playwright() as playwright:
+            browser = None
+            context = None
+            try:
+                # Launch up front so the first job finds a warm browser.
+                browser, context = self._launch(playwright)
+            except Exception:
+                logger.exception("Browser slot %s failed to launch; retrying on first job", slot)
+            jobs_on_context = 0
+            while True:
+                item = self._jobs.get()
+                if item is _STOP:
+                    break
+                fn, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    if not self._healthy(browser):
+                        if browser is not None:
+                            logger.warning("Browser slot %s disconnected; relaunching", slot)
+                        self._close_quietly(browser)
+                        browser, context = self._launch(playwright)
+                        jobs_on_context = 0
+                    elif jobs_on_context >= self.recycle_after:
+                        self._close_quietly(context)
+                        context = browser.new_context(**self.context_options)
+                        jobs_on_context = 0
+                except Exception as err:
+                    logger.exception("Browser slot %s failed to launch", slot)
+                    browser = None
+                    context = None
+                    future.set_exception(err)
+                    continue
+
+                page = None
+                timed_out = False
+                try:
+                    page = context.new_page()
+                    future.set_result(fn(page))
+                except Exception as err:
+                    timed_out = isinstance(err, TimeoutError)
+                    future.set_exception(err)
+                finally:
+                    self._close_quietly(page)
+                    jobs_on_context += 1
+                if timed_out:
+                    logger.warning("Job on browser slot %s timed out; relaunching the browser", slot)
+                    self._close_quietly(context)
+                    self._close_quietly(browser)
+                    browser = None
+                    context = None
+
+            self._close_quietly(context)
+            self._close_quietly(browser)
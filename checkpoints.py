@@ -0,0 +1,205 @@
+"""Per-stage checkpoints that let a VOOM job resume after a crash.
+
+A job record lives in the shared store under ``job:<job_id>`` and is
+rewritten after the crawl, after each Gemini batch, after the final
+analysis and after each Notion write, and touched by a heartbeat in
+between. Once a worker picks the job up it holds ``lease:job:<job_id>``,
+renewed by the same heartbeat; jobs whose process has died are picked up
+again by ``claim_orphaned`` at startup.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+
+from store import owner_alive, owner_id
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+CRAWLED = "crawled"
+ANALYZED = "analyzed"
+PUBLISHED = "published"
+
+RECORD_TTL_SECONDS = 7 * 24 * 3600
+
+
+class JobCheckpoint:
+    """Persisted progress of one VOOM job.
+
+    Stages advance ``queued`` -> ``crawled`` -> ``analyzed`` -> ``published``;
+    Gemini batch reports and the Notion page with the blocks written so far
+    are kept alongside, so a resumed job skips every call that already
+    succeeded.
+
+    From ``create`` until ``stop`` or ``complete`` a heartbeat rewrites the
+    record every ``lease_seconds / 3``, so a job waiting in another host's
+    queue is not mistaken for an orphan; after ``acquire`` it renews the
+    lease as well.
+    """
+
+    def __init__(self, store, job_id, state, lease_seconds=900):
+        self.store = store
+        self.job_id = job_id
+        self.lease_seconds = lease_seconds
+        self.state = state
+        self.resumed = False
+        self._leased = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    @classmethod
+    def create(cls, store, job_id=None, lease_seconds=900, **fields):
+        state = {"stage": QUEUED, "created_at": time.time(), "batches": {}, **fields}
+        checkpoint = cls(store, job_id or uuid.uuid4().hex, state, lease_seconds)
+        checkpoint._save()
+        checkpoint._start_heartbeat()
+        return checkpoint
+
+    @property
+    def _key(self):
+        return f"job:{self.job_id}"
+
+    @property
+    def _lease_key(self):
+        return f"lease:job:{self.job_id}"
+
+    @property
+    def stage(self):
+        return self.state["stage"]
+
+    def get(self, field, default=None):
+        with self._lock:
+            return self.state.get(field, default)
+
+    def _save(self, **changes):
+        with self._lock:
+            self.state.update(changes)
+            self._write()
+
+    def _write(self):
+        # Callers hold self._lock.
+        self.state["updated_at"] = time.time()
+        self.state["owner"] = owner_id()
+        payload = json.dumps(self.state, ensure_ascii=False)
+        self.store.set(self._key, payload, ttl=RECORD_TTL_SECONDS)
+        if self._leased:
+            self.store.set(self._lease_key, owner_id(), ttl=self.lease_seconds)
+
+    def acquire(self):
+        """Take the lease when a worker starts the job; False if another owner holds it."""
+        with self._lock:
+            holder = self.store.get(self._lease_key)
+            if holder not in (None, owner_id()):
+                return False
+            self.store.set(self._lease_key, owner_id(), ttl=self.lease_seconds)
+            self._leased = True
+        self._start_heartbeat()
+        return True
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is not None or self._stopped.is_set():
+                return
+            self._heartbeat = threading.Thread(
+                target=self._beat,
+                name=f"job-heartbeat-{self.job_id[:8]}",
+                daemon=True,
+            )
+            self._heartbeat.start()
+
+    def _beat(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self._touch()
+            except Exception:
+                logger.exception("Failed to renew job %s", self.job_id)
+
+    def _touch(self):
+        with self._lock:
+            # complete() may have deleted the record meanwhile; don't bring it back.
+            if not self._stopped.is_set():
+                self._write()
+
+    def stop(self):
+        """Stop the heartbeat; the record and lease are left to expire or be claimed."""
+        self._stopped.set()
+
+    def crawled(self, image_names):
+        self._save(stage=CRAWLED, images=list(image_names))
+
+    def batch_report(self, batch_key):
+        with self._lock:
+            return self.state["batches"].get(batch_key)
+
+    def save_batch(self, batch_key, report):
+        with self._lock:
+            self.state["batches"][batch_key] = report
+        self._save()
+
+    def analyzed(self, text):
+        self._save(stage=ANALYZED, analysis=text)
+
+    def page_created(self, page_id, notion_url, appended=0):
+        self._save(page_id=page_id, notion_url=notion_url, appended=appended, block_ids=[])
+
+    def blocks_appended(self, appended, block_ids=None):
+        changes = {"appended": appended}
+        if block_ids is not None:
+            changes["block_ids"] = list(block_ids)
+        self._save(**changes)
+
+    def published(self, notion_url):
+        self._save(stage=PUBLISHED, notion_url=notion_url)
+
+    def complete(self):
+        """Forget the job once its outcome has been delivered."""
+        with self._lock:
+            self._stopped.set()
+            self.store.delete(self._key)
+            self.store.delete(self._lease_key)
+
+
+def claim_orphaned(store, lease_seconds=900):
+    """Take over every unfinished job whose worker is gone.
+
+    A job owned by a dead process on this host is taken at once. A job
+    owned on another host is only taken once it has neither a lease nor a
+    record update for ``lease_seconds``, i.e. its heartbeat has stopped.
+    """
+    claimed = []
+    for key in store.scan("job:"):
+        job_id = key[len("job:"):]
+        raw = store.get(key)
+        if raw is None:
+            continue
+        try:
+            state = json.loads(raw)
+        except ValueError:
+            logger.warning("Dropping unreadable job checkpoint %s", job_id)
+            store.delete(key)
+            continue
+        lease_key = f"lease:job:{job_id}"
+        holder = store.get(lease_key)
+        alive = owner_alive(holder or state.get("owner"))
+        if alive:
+            continue
+        if alive is None:
+            # Owned on another host: leased while running, heartbeat while queued.
+            if holder is not None:
+                continue
+            if time.time() - state.get("updated_at", 0) < lease_seconds:
+                continue
+        if holder is not None and not store.delete_if(lease_key, holder):
+            continue
+        if not store.add(lease_key, owner_id(), ttl=lease_seconds):
+            continue
+        checkpoint = JobCheckpoint(store, job_id, state, lease_seconds)
+        checkpoint.resumed = True
+        checkpoint._leased = True
+        checkpoint._save()
+        checkpoint._start_heartbeat()
+        claimed.append(checkpoint)
+    return claimed
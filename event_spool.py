@@ -0,0 +1,185 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+from store import process_alive
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS webhook_events ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " body TEXT NOT NULL,"
+    " signature TEXT NOT NULL,"
+    " status TEXT NOT NULL,"
+    " attempts INTEGER NOT NULL DEFAULT 0,"
+    " error TEXT,"
+    " owner INTEGER,"
+    " received_at REAL NOT NULL,"
+    " updated_at REAL NOT NULL)"
+)
+
+
+class EventSpool:
+    """Durable SQLite spool of raw webhook bodies.
+
+    The webhook endpoint only appends; ``start`` launches consumer threads
+    that claim events in arrival order and pass them to ``handle(body,
+    signature)``. Several worker processes on one host may share the spool
+    file: claims are atomic and record the claiming pid, and ``recover`` at
+    startup puts back in line only the ``processing`` events whose process
+    is gone. Failed events are retried up to ``max_attempts`` times.
+    """
+
+    def __init__(self, path, handle, workers=2, max_attempts=3, keep_done_seconds=24 * 3600):
+        self.path = path
+        self.handle = handle
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.keep_done_seconds = keep_done_seconds
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._threads = []
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(webhook_events)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE webhook_events ADD COLUMN owner INTEGER")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS webhook_events_status ON webhook_events (status, id)"
+        )
+
+    def append(self, body, signature):
+        now = time.time()
+        with self._wakeup:
+            cur = self._conn.execute(
+                "INSERT INTO webhook_events (body, signature, status, received_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (body, signature, PENDING, now, now),
+            )
+            self._wakeup.notify()
+            return cur.lastrowid
+
+    def recover(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner FROM webhook_events WHERE status = ?", (PROCESSING,)
+            ).fetchall()
+            orphans = [event_id for event_id, owner in rows if not process_alive(owner)]
+            for event_id in orphans:
+                self._conn.execute(
+                    "UPDATE webhook_events SET status = ?, owner = NULL, updated_at = ?"
+                    " WHERE id = ? AND status = ?",
+                    (PENDING, time.time(), event_id, PROCESSING),
+                )
+        if orphans:
+            logger.warning("Requeued %s webhook events interrupted by a restart", len(orphans))
+        return len(orphans)
+
+    def purge_done(self):
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM webhook_events WHERE status = ? AND updated_at < ?",
+                (DONE, time.time() - self.keep_done_seconds),
+            )
+        return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM webhook_events GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def _claim_one(self):
+        # BEGIN IMMEDIATE so two processes never claim the same event.
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT id, body, signature, attempts FROM webhook_events"
+                " WHERE status = ? ORDER BY id LIMIT 1",
+                (PENDING,),
+            ).fetchone()
+            if row:
+                self._conn.execute(
+                    "UPDATE webhook_events SET status = ?, attempts = attempts + 1,"
+                    " owner = ?, updated_at = ? WHERE id = ?",
+                    (PROCESSING, os.getpid(), time.time(), row[0]),
+                )
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        return row
+
+    def _claim(self):
+        with self._wakeup:
+            while not self._stopping:
+                row = self._claim_one()
+                if row:
+                    return row
+                # Events appended by another process only show up on the
+                # next poll, so keep the wait short.
+                self._wakeup.wait(timeout=1.0)
+            return None
+
+    def _finish(self, event_id, status, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE webhook_events SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), event_id),
+            )
+
+    def _worker(self):
+        while True:
+            row = self._claim()
+            if row is None:
+                return
+            event_id, body, signature, attempts = row
+            try:
+                self.handle(body, signature)
+            except Exception:
+                error = traceback.format_exc()
+                logger.error("Webhook event %s failed\n%s", event_id, error)
+                retry = attempts + 1 < self.max_attempts
+                self._finish(event_id, PENDING if retry else FAILED, error)
+                continue
+            self._finish(event_id, DONE)
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+        self.recover()
+        self.purge_done()
+        for idx in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker,
+                name=f"webhook-spool-{idx}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self, timeout=None):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+            threads = list(self._threads)
+            self._threads = []
+        for thread in threads:
+            thread.join(timeout)
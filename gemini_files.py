@@ -0,0 +1,132 @@
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+_EXTENSIONS = {
+    "image/webp": ".webp",
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+}
+
+
+class GeminiFileCache:
+    """Uploads image bytes once through the Gemini File API and reuses the handle.
+
+    Handles are keyed by the SHA-256 of the bytes actually sent, so batch
+    calls, retries and later jobs with the same image reference the uploaded
+    file instead of re-sending it inline. A handle is dropped ``margin_seconds``
+    before the server-side expiration (48 hours after upload).
+
+    When a shared ``store`` is given, uploaded file names are published there
+    so other workers reuse them, and uploads of one key are serialized
+    across processes.
+    """
+
+    def __init__(self, margin_seconds=600, processing_timeout=30.0, store=None):
+        self.store = store
+        self.margin_seconds = margin_seconds
+        self.processing_timeout = processing_timeout
+        self.uploads = 0
+        self.reuses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._files = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _remember(self, key, file):
+        expires_at = file.expiration_time.timestamp()
+        with self._lock:
+            self._files[key] = (file, expires_at)
+        return expires_at
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is not None:
+                file, expires_at = entry
+                if time.time() < expires_at - self.margin_seconds:
+                    return file
+                del self._files[key]
+        if self.store is None:
+            return None
+        name = self.store.get(f"gemini_file:{key}")
+        if name is None:
+            return None
+        try:
+            file = genai.get_file(name)
+        except Exception:
+            logger.warning("Shared Gemini file %s is gone; uploading again", name)
+            self.store.delete(f"gemini_file:{key}")
+            return None
+        self._remember(key, file)
+        return file
+
+    @contextlib.contextmanager
+    def _upload_lock(self, key):
+        with self._key_lock(key):
+            if self.store is None:
+                yield
+                return
+            with self.store.lock(f"gemini_file:{key}", ttl=self.processing_timeout + 120):
+                yield
+
+    def _wait_until_active(self, file):
+        deadline = time.monotonic() + self.processing_timeout
+        while file.state.name == "PROCESSING" and time.monotonic() < deadline:
+            time.sleep(0.5)
+            file = genai.get_file(file.name)
+        if file.state.name != "ACTIVE":
+            raise RuntimeError(f"Gemini 檔案 {file.name} 狀態為 {file.state.name}")
+        return file
+
+    def _upload(self, mime_type, data):
+        fd, tmp_path = tempfile.mkstemp(suffix=_EXTENSIONS.get(mime_type, ""))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            file = genai.upload_file(tmp_path, mime_type=mime_type)
+        finally:
+            os.remove(tmp_path)
+        return self._wait_until_active(file)
+
+    def get_or_upload(self, key, mime_type, data):
+        file = self._lookup(key)
+        if file is not None:
+            with self._lock:
+                self.reuses += 1
+            return file
+        # Serialize uploads per key so parallel batches upload an image once.
+        with self._upload_lock(key):
+            file = self._lookup(key)
+            if file is not None:
+                with self._lock:
+                    self.reuses += 1
+                return file
+            file = self._upload(mime_type, data)
+            expires_at = self._remember(key, file)
+            with self._lock:
+                self.uploads += 1
+            if self.store is not None:
+                ttl = expires_at - time.time() - self.margin_seconds
+                if ttl > 0:
+                    self.store.set(f"gemini_file:{key}", file.name, ttl=ttl)
+            logger.info("Uploaded %s bytes to Gemini as %s", len(data), file.name)
+            return file
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "uploads": self.uploads,
+                "reuses": self.reuses,
+            }
@@ -0,0 +1,72 @@
+import uuid
+
+from store import MemoryStore, owner_alive, owner_id
+
+DONE = "done"
+
+
+class IdempotencyStore:
+    """Remembers recently seen keys (webhook event ids, message ids).
+
+    Keys live in the shared ``store``, so a redelivery landing on another
+    worker or host is still recognized. A key is first ``claim``-ed by the
+    handler working on it and marked ``done`` once the event's effect (the
+    queued job) exists; only then is it kept for ``ttl_seconds``. A claim
+    left behind by a process that died mid-handle is taken over by the next
+    attempt, and any other claim lapses after ``claim_ttl_seconds``.
+    """
+
+    def __init__(self, store=None, ttl_seconds=24 * 3600, claim_ttl_seconds=900):
+        self.store = store or MemoryStore()
+        self.ttl_seconds = ttl_seconds
+        self.claim_ttl_seconds = claim_ttl_seconds
+
+    @staticmethod
+    def _k(key):
+        return f"idempotency:{key}"
+
+    def _add_claim(self, key, claim):
+        if self.store.add(self._k(key), claim, ttl=self.claim_ttl_seconds):
+            return True
+        current = self.store.get(self._k(key))
+        if current is None:
+            return self.store.add(self._k(key), claim, ttl=self.claim_ttl_seconds)
+        if current == DONE:
+            return False
+        holder = current.split(":", 2)[-1]
+        if owner_alive(holder) is not False:
+            return False
+        # The handler that claimed this key died before finishing it.
+        if not self.store.delete_if(self._k(key), current):
+            return False
+        return self.store.add(self._k(key), claim, ttl=self.claim_ttl_seconds)
+
+    def claim(self, keys):
+        """Return True if the keys are free (and claim them), False if seen before."""
+        keys = [key for key in keys if key]
+        claim = f"claimed:{uuid.uuid4().hex}:{owner_id()}"
+        added = []
+        for key in keys:
+            if not self._add_claim(key, claim):
+                # Undo only what this call recorded; the other keys belong to
+                # whoever claimed them first.
+                for prior in added:
+                    self.store.delete_if(self._k(prior), claim)
+                self.store.incr("idempotency:duplicates")
+                return False
+            added.append(key)
+        return True
+
+    def done(self, keys):
+        """Mark claimed keys as handled for the full ``ttl_seconds``."""
+        for key in keys:
+            if key:
+                self.store.set(self._k(key), DONE, ttl=self.ttl_seconds)
+
+    def release(self, keys):
+        for key in keys:
+            if key:
+                self.store.delete(self._k(key))
+
+    def stats(self):
+        return {"duplicates": int(self.store.get("idempotency:duplicates") or 0)}
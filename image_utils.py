@@ -0,0 +1,125 @@
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; hashing and resizing are skipped without it
+    Image = None
+    ImageOps = None
+
+_FORMATS = {
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+}
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pixel_hash(path):
+    """SHA-256 of the decoded RGB pixels and size, or None without Pillow.
+
+    Matches copies whose file bytes differ only in container or metadata
+    (EXIF stripped, PNG re-saved) but whose pixels are identical. Unlike a
+    perceptual hash it never matches a chart whose numbers changed.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            rgb = img.convert("RGB")
+            digest = hashlib.sha256(f"{rgb.width}x{rgb.height}:".encode("ascii"))
+            digest.update(rgb.tobytes())
+    except Exception:
+        return None
+    return digest.hexdigest()
+
+
+def image_fingerprint(path):
+    """Return ``{"sha256": ..., "pixels": ...}`` for a downloaded image."""
+    return {"sha256": sha256_file(path), "pixels": pixel_hash(path)}
+
+
+def _raw_image(path):
+    mime_type, _ = mimetypes.guess_type(path)
+    with open(path, "rb") as f:
+        return mime_type or "image/jpeg", f.read()
+
+
+def _encode(path, max_dim, fmt, quality):
+    pil_format, mime_type, _ = _FORMATS[fmt]
+    with Image.open(path) as img:
+        # Apply EXIF rotation before the metadata is dropped by re-encoding.
+        img = ImageOps.exif_transpose(img)
+        if max_dim and max(img.size) > max_dim:
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        buf = io.BytesIO()
+        if pil_format == "WEBP":
+            img.save(buf, format=pil_format, quality=quality, method=4)
+        else:
+            img.save(buf, format=pil_format, quality=quality, optimize=True)
+    return mime_type, buf.getvalue()
+
+
+class ImagePreprocessor:
+    """Downscales and re-encodes images before they are sent to Gemini.
+
+    Images are resized so the longer side is at most ``max_dim`` (0 keeps the
+    size), re-encoded as WebP or JPEG at ``quality`` and thereby stripped of
+    metadata. Results are cached on disk under ``cache_dir`` by the source's
+    SHA-256 and the settings. Without Pillow, or when re-encoding would make
+    the file bigger, the original bytes are used.
+    """
+
+    def __init__(self, cache_dir, max_dim=2048, fmt="webp", quality=85):
+        self.cache_dir = cache_dir
+        self.max_dim = max_dim
+        self.fmt = fmt if fmt in _FORMATS else "webp"
+        self.quality = quality
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def _cache_path(self, digest):
+        _, _, ext = _FORMATS[self.fmt]
+        name = f"{digest}-{self.max_dim}-q{self.quality}{ext}"
+        return os.path.join(self.cache_dir, name)
+
+    def prepare(self, path, digest=None):
+        """Return ``(mime_type, data)`` for ``path``."""
+        if not self.enabled:
+            return _raw_image(path)
+        digest = digest or sha256_file(path)
+        cache_path = self._cache_path(digest)
+        _, mime_type, _ = _FORMATS[self.fmt]
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                return mime_type, f.read()
+        try:
+            mime_type, data = _encode(path, self.max_dim, self.fmt, self.quality)
+        except Exception:
+            return _raw_image(path)
+        raw_mime, raw = _raw_image(path)
+        if len(data) >= len(raw):
+            return raw_mime, raw
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        return mime_type, data
@@ -0,0 +1,195 @@
+import logging
+import queue
+import threading
+import time
+import traceback
+
+from store import MemoryStore
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED = "accepted"
+QUEUE_FULL = "queue_full"
+USER_LIMIT = "user_limit"
+SHUTTING_DOWN = "shutting_down"
+COALESCED = "coalesced"
+
+_STOP = object()
+
+
+class JobScheduler:
+    """Bounded job queue drained by a fixed number of worker threads.
+
+    ``submit`` never blocks: it returns ``(status, position)`` where status is
+    one of ``ACCEPTED``, ``QUEUE_FULL``, ``USER_LIMIT`` or ``SHUTTING_DOWN``
+    and position is the job's 1-based place in line (0 means a worker picks
+    it up right away). Each user may have at most ``per_user_limit``
+    jobs queued or running at once; those counts live in ``store`` so the
+    limit holds across every worker process sharing it. A count expires
+    ``count_ttl`` seconds after its last change in case the process holding
+    it dies, and never drops below zero. Once
+    ``shutdown`` has been called every ``submit`` returns ``SHUTTING_DOWN``.
+    """
+
+    def __init__(self, workers=2, max_queue=20, per_user_limit=2, store=None, count_ttl=6 * 3600):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.per_user_limit = max(1, per_user_limit)
+        self.store = store or MemoryStore()
+        self.count_ttl = count_ttl
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+        self._accepting = False
+        self._closed = False
+
+    def start(self):
+        with self._lock:
+            # A scheduler that was shut down stays down; start() is not a restart.
+            if self._threads or self._closed:
+                return
+            for idx in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"voom-worker-{idx}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._accepting = True
+
+    def submit(self, user_key, fn, *args):
+        self.start()
+        with self._lock:
+            if not self._accepting:
+                return SHUTTING_DOWN, 0
+            count_key = self._count_key(user_key)
+            count = self.store.incr(count_key, ttl=self.count_ttl)
+            if count > self.per_user_limit:
+                self._release_slot(user_key)
+                return USER_LIMIT, count - 1
+            waiting = self._queue.qsize()
+            idle = max(0, self.workers - self._running - waiting)
+            try:
+                self._queue.put_nowait((user_key, fn, args))
+            except queue.Full:
+                self._release_slot(user_key)
+                return QUEUE_FULL, waiting
+        position = 0 if idle else waiting + 1
+        return ACCEPTED, position
+
+    @staticmethod
+    def _count_key(user_key):
+        return f"jobs:user:{user_key}"
+
+    def _release_slot(self, user_key):
+        self.store.incr(self._count_key(user_key), -1, ttl=self.count_ttl, floor=0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+            }
+
+    def shutdown(self, timeout=None):
+        """Stop accepting jobs and wait for queued and running jobs to finish."""
+        with self._lock:
+            self._accepting = False
+            self._closed = True
+            threads = list(self._threads)
+            self._threads = []
+        for _ in threads:
+            # Blocking put: stop markers queue up behind the pending jobs.
+            self._queue.put(_STOP)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            thread.join(remaining)
+            if thread.is_alive():
+                logger.warning("Worker %s still running after shutdown timeout", thread.name)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            user_key, fn, args = item
+            with self._lock:
+                self._running += 1
+            try:
+                fn(*args)
+            except Exception:
+                logger.error("Job failed\n%s", traceback.format_exc())
+            finally:
+                with self._lock:
+                    self._running -= 1
+                self._release_slot(user_key)
+
+
+class SingleFlight:
+    """Coalesces concurrent jobs that share a key.
+
+    The first caller of ``join`` for a key starts the job through
+    ``start_fn``; later callers are recorded as waiters of the running job
+    and get ``COALESCED`` back. The job calls ``waiters`` to see who to
+    notify and ``finish`` to release the key and collect the final list.
+
+    Flights and waiters live in ``store``, so a post shared on one worker
+    joins the job already running on another. A flight is forgotten after
+    ``ttl`` seconds if its worker dies before calling ``finish``.
+    """
+
+    def __init__(self, store=None, ttl=3600):
+        self.store = store or MemoryStore()
+        self.ttl = ttl
+
+    @staticmethod
+    def _k(key):
+        if isinstance(key, tuple):
+            key = ":".join(str(part) for part in key)
+        return f"flight:{key}"
+
+    def join(self, key, waiter, start_fn):
+        flight = self._k(key)
+        with self.store.lock(flight, ttl=30):
+            if self.store.get(flight) is not None:
+                waiters = self.store.lrange(flight + ":waiters")
+                if waiter not in waiters:
+                    waiters.append(waiter)
+                    self.store.rpush(flight + ":waiters", waiter, ttl=self.ttl)
+                return COALESCED, len(waiters)
+            self.store.set(flight, str(time.time()), ttl=self.ttl)
+            self.store.rpush(flight + ":waiters", waiter, ttl=self.ttl)
+            try:
+                result = start_fn()
+            except BaseException:
+                # Otherwise later shares coalesce onto a job that never runs.
+                self._drop(flight)
+                raise
+            if result[0] != ACCEPTED:
+                self._drop(flight)
+            return result
+
+    def waiters(self, key):
+        return self.store.lrange(self._k(key) + ":waiters")
+
+    def finish(self, key):
+        flight = self._k(key)
+        with self.store.lock(flight, ttl=30):
+            waiters = self.store.lrange(flight + ":waiters")
+            if self.store.get(flight) is not None:
+                self._drop(flight)
+            return waiters
+
+    def _drop(self, flight):
+        self.store.delete(flight)
+        self.store.delete(flight + ":waiters")
+
+    def __len__(self):
+        # Counted from the live keys so flights that expired drop out too.
+        # Redis also lists the ``:waiters`` lists under the same prefix.
+        return sum(1 for key in self.store.scan("flight:") if not key.endswith(":waiters"))
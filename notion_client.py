@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+NOTION_API_URL = "https://api.notion.com/v1"
+NOTION_VERSION = "2022-06-28"
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+def _httpx_http2():
+    """Return the httpx module if it can speak HTTP/2 (needs ``httpx[http2]``)."""
+    try:
+        import h2  # noqa: F401
+        import httpx
+    except ImportError:
+        return None
+    return httpx
+
+
+class NotionClient:
+    """Notion API client sharing one pooled, keep-alive connection set.
+
+    Every page create, block append and block delete reuses connections to
+    api.notion.com instead of opening a new TCP+TLS connection per call.
+    With ``http2`` and ``httpx[http2]`` installed, requests are multiplexed
+    over HTTP/2; otherwise a ``requests.Session`` keeps up to ``pool_size``
+    connections alive, which should cover the number of jobs writing to
+    Notion at once. Responses from both transports expose ``status_code``,
+    ``text``, ``headers`` and ``json()``.
+    """
+
+    def __init__(
+        self,
+        token,
+        base_url=NOTION_API_URL,
+        version=NOTION_VERSION,
+        pool_size=10,
+        timeout=30,
+        max_retries=3,
+        retry_base_delay=1.0,
+        http2=True,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.requests_sent = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Notion-Version": version,
+            "Content-Type": "application/json",
+        }
+        httpx = _httpx_http2() if http2 else None
+        if httpx is not None:
+            self.transport = "httpx/http2"
+            self._client = httpx.Client(
+                http2=True,
+                headers=headers,
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                ),
+            )
+        else:
+            self.transport = "requests"
+            session = requests.Session()
+            session.headers.update(headers)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._client = session
+
+    def _url(self, path):
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _send(self, method, url, payload):
+        if self.transport == "requests":
+            return self._client.request(method, url, json=payload, timeout=self.timeout)
+        return self._client.request(method, url, json=payload)
+
+    def request(self, method, path, payload=None):
+        """Send one API call, retrying rate limits and gateway errors."""
+        url = self._url(path)
+        for attempt in range(self.max_retries + 1):
+            resp = self._send(method, url, payload)
+            with self._lock:
+                self.requests_sent += 1
+            if resp.status_code < 400:
+                return resp
+            if resp.status_code not in RETRY_STATUSES:
+                return resp
+            if attempt >= self.max_retries:
+                return resp
+            retry_after = resp.headers.get("Retry-After")
+            delay = self.retry_base_delay * (2 ** attempt)
+            if retry_after:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    pass
+            with self._lock:
+                self.retries += 1
+            time.sleep(delay)
+        return resp
+
+    def stats(self):
+        with self._lock:
+            return {
+                "transport": self.transport,
+                "requests": self.requests_sent,
+                "retries": self.retries,
+            }
+
+    def close(self):
+        self._client.close()
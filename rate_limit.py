@@ -0,0 +1,27 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Spaces calls evenly so no more than ``per_minute`` start in any minute.
+
+    ``acquire`` blocks the calling thread until its slot comes up. A limiter
+    built with ``per_minute`` of 0 or less never waits.
+    """
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute and per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
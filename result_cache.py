@@ -0,0 +1,146 @@
+"""Persistent cache of finished VOOM analyses.
+
+Entries map (post id, report mode, prompt version, model name) to the Notion
+page that was created for them, so the same post shared again is answered
+without crawling, calling Gemini or creating a duplicate page.
+
+    python result_cache.py invalidate <VOOM 網址、post id 或 all>
+    python result_cache.py stats
+"""
+import hashlib
+import re
+import sys
+
+from store import default_store_url, open_store
+
+_POST_ID_RE = re.compile(r"/post/([^/?#]+)")
+
+
+def voom_post_id(url_or_id):
+    """Normalize a VOOM URL (voom.line.me or linevoom.line.me) to its post id."""
+    value = (url_or_id or "").strip()
+    match = _POST_ID_RE.search(value)
+    if match:
+        return match.group(1)
+    return value.rstrip("/")
+
+
+def prompt_version(prompt_template):
+    return hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:12]
+
+
+class _StoreCache:
+    """Shared base: entries and hit/miss counters live in a ``store.Store``.
+
+    Counters sit under ``metrics:<namespace>:`` so invalidating the entries
+    (``delete_prefix("<namespace>:")``) leaves them alone.
+    """
+
+    namespace = None
+
+    def __init__(self, store, ttl_seconds=7 * 24 * 3600):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    def _metric(self, outcome):
+        return f"metrics:{self.namespace}:{outcome}"
+
+    def _count(self, outcome):
+        self.store.incr(self._metric(outcome))
+
+    def stats(self):
+        hits = int(self.store.get(self._metric("hits")) or 0)
+        misses = int(self.store.get(self._metric("misses")) or 0)
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+        }
+
+
+class ResultCache(_StoreCache):
+    namespace = "result"
+
+    def _k(self, post_id, mode, version, model_name):
+        return f"result:{post_id}|{mode}|{version}|{model_name}"
+
+    def get(self, post_id, mode, version, model_name):
+        notion_url = self.store.get(self._k(post_id, mode, version, model_name))
+        self._count("hits" if notion_url else "misses")
+        return notion_url
+
+    def put(self, post_id, mode, version, model_name, notion_url):
+        self.store.set(
+            self._k(post_id, mode, version, model_name),
+            notion_url,
+            ttl=self.ttl_seconds,
+        )
+
+    def invalidate(self, post_id=None):
+        """Drop entries for ``post_id`` (every mode/prompt/model), or all entries."""
+        if post_id is None:
+            return self.store.delete_prefix("result:")
+        return self.store.delete_prefix(f"result:{post_id}|")
+
+
+class AnalysisCache(_StoreCache):
+    """Gemini analysis text keyed by prompt + model + the hashes of its images.
+
+    Each result is stored under the SHA-256 of every image file and, when
+    Pillow is available, under the SHA-256 of every image's decoded pixels.
+    "Near-identical" therefore means pixel-identical: a re-saved or
+    metadata-stripped copy is served from cache, but a daily chart template
+    with different numbers never is. Perceptual hashes are deliberately not
+    used as keys because they cannot tell such charts apart.
+    """
+
+    namespace = "analysis"
+
+    @staticmethod
+    def keys_for(prompt, model_name, fingerprints):
+        base = hashlib.sha256()
+        base.update(model_name.encode("utf-8"))
+        base.update(b"\0")
+        base.update(prompt.encode("utf-8"))
+        keys = []
+        for field in ("sha256", "pixels"):
+            values = [fp.get(field) for fp in fingerprints]
+            if not values or not all(values):
+                continue
+            digest = base.copy()
+            digest.update(("\0" + field + ":" + ",".join(values)).encode("utf-8"))
+            keys.append(f"{field}:{digest.hexdigest()}")
+        return keys
+
+    def get(self, keys):
+        for key in keys:
+            text = self.store.get(f"analysis:{key}")
+            if text is not None:
+                self._count("hits")
+                return text
+        self._count("misses")
+        return None
+
+    def put(self, keys, text):
+        for key in keys:
+            self.store.set(f"analysis:{key}", text, ttl=self.ttl_seconds)
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ("invalidate", "stats") or argv[1:] == ["invalidate"]:
+        print(__doc__.strip().splitlines()[-2].strip())
+        print(__doc__.strip().splitlines()[-1].strip())
+        return 1
+    cache = ResultCache(open_store(default_store_url()))
+    if argv[1] == "stats":
+        print(cache.stats())
+        return 0
+    target = None if argv[2] == "all" else voom_post_id(argv[2])
+    removed = cache.invalidate(target)
+    print(f"已刪除 {removed} 筆快取")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,482 @@
+"""Shared state backends for caches, idempotency keys, job records and locks.
+
+Every process of the bot talks to the same ``Store`` so several uvicorn or
+gunicorn workers, or several hosts, can run side by side:
+
+* ``memory://`` - in-process dict, for tests and single-worker runs
+* ``sqlite:///path/to/file.sqlite3`` - shared by all workers on one host
+* ``redis://host:6379/0`` - any Redis-protocol server, shared across hosts
+  (needs ``pip install redis``)
+
+Values are strings; callers JSON-encode structured data.
+"""
+import abc
+import contextlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class Store(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add(self, key, value, ttl=None):
+        """Set ``key`` only if it does not exist; return True when it was set."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_if(self, key, value):
+        """Delete ``key`` only while it still holds ``value``."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_prefix(self, prefix):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def scan(self, prefix):
+        """Return the live keys starting with ``prefix``."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def incr(self, key, amount=1, ttl=None, floor=None):
+        """Add ``amount`` and return the new value.
+
+        ``ttl`` (re)starts the key's expiry on every call. With ``floor`` the
+        value never drops below it, and a decrement leaves a missing key
+        missing instead of creating it.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def rpush(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def lrange(self, key):
+        raise NotImplementedError
+
+    def purge_expired(self):
+        return 0
+
+    @contextlib.contextmanager
+    def lock(self, name, ttl=60, timeout=None, poll=0.05):
+        """Cross-process mutex that expires after ``ttl`` seconds if its holder dies."""
+        key = f"lock:{name}"
+        token = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.add(key, token, ttl=ttl):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"無法取得鎖 {name}")
+            time.sleep(poll)
+        try:
+            yield
+        finally:
+            self.delete_if(key, token)
+
+
+class MemoryStore(Store):
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        self._values = {}
+        self._lists = {}
+
+    def _expired(self, expires_at, now=None):
+        return expires_at is not None and (now or time.time()) >= expires_at
+
+    def _live(self, table, key):
+        entry = table.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[1]):
+            del table[key]
+            return None
+        return entry
+
+    def _expiry(self, ttl):
+        return time.time() + ttl if ttl else None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(self._values, key)
+            return entry[0] if entry else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            if len(self._values) >= self.max_entries and key not in self._values:
+                self.purge_expired()
+                if len(self._values) >= self.max_entries:
+                    # Oldest insertion goes first, like the bounded stores it replaces.
+                    del self._values[next(iter(self._values))]
+            self._values[key] = (value, self._expiry(ttl))
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if self._live(self._values, key):
+                return False
+            self.set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+            self._lists.pop(key, None)
+
+    def delete_if(self, key, value):
+        with self._lock:
+            if self.get(key) == value:
+                del self._values[key]
+                return True
+            return False
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            keys = [key for key in self._values if key.startswith(prefix)]
+            for key in keys:
+                del self._values[key]
+            return len(keys)
+
+    def scan(self, prefix):
+        with self._lock:
+            return [
+                key for key in list(self._values)
+                if key.startswith(prefix) and self._live(self._values, key)
+            ]
+
+    def incr(self, key, amount=1, ttl=None, floor=None):
+        with self._lock:
+            entry = self._live(self._values, key)
+            if entry is None:
+                if floor is not None and amount < 0:
+                    return floor
+                value, expires_at = amount, None
+            else:
+                value, expires_at = int(entry[0]) + amount, entry[1]
+            if floor is not None:
+                value = max(value, floor)
+            if ttl:
+                expires_at = self._expiry(ttl)
+            self._values[key] = (str(value), expires_at)
+            return value
+
+    def rpush(self, key, value, ttl=None):
+        with self._lock:
+            entry = self._live(self._lists, key)
+            if entry is None:
+                entry = ([], self._expiry(ttl))
+                self._lists[key] = entry
+            entry[0].append(value)
+            return len(entry[0])
+
+    def lrange(self, key):
+        with self._lock:
+            entry = self._live(self._lists, key)
+            return list(entry[0]) if entry else []
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            removed = 0
+            for table in (self._values, self._lists):
+                expired = [key for key, entry in table.items() if self._expired(entry[1], now)]
+                for key in expired:
+                    del table[key]
+                removed += len(expired)
+            return removed
+
+
+class SQLiteStore(Store):
+    """Store in a SQLite file; safe across processes on the same host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv_lists ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_lists_key ON kv_lists (key, seq)")
+
+    @contextlib.contextmanager
+    def _tx(self):
+        # BEGIN IMMEDIATE takes the write lock up front so read-modify-write
+        # sequences are atomic across processes.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _expiry(ttl):
+        return time.time() + ttl if ttl else None
+
+    def _get(self, conn, key):
+        row = conn.execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def get(self, key):
+        with self._lock:
+            return self._get(self._conn, key)
+
+    def set(self, key, value, ttl=None):
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                (key, value, self._expiry(ttl)),
+            )
+
+    def add(self, key, value, ttl=None):
+        with self._tx() as conn:
+            if self._get(conn, key) is not None:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                (key, value, self._expiry(ttl)),
+            )
+            return True
+
+    def delete(self, key):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            conn.execute("DELETE FROM kv_lists WHERE key = ?", (key,))
+
+    def delete_if(self, key, value):
+        with self._tx() as conn:
+            cur = conn.execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, value))
+            return cur.rowcount > 0
+
+    @staticmethod
+    def _like(prefix):
+        return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    def delete_prefix(self, prefix):
+        with self._tx() as conn:
+            cur = conn.execute("DELETE FROM kv WHERE key LIKE ? ESCAPE '\\'", (self._like(prefix),))
+            return cur.rowcount
+
+    def scan(self, prefix):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM kv WHERE key LIKE ? ESCAPE '\\'"
+                " AND (expires_at IS NULL OR expires_at > ?)",
+                (self._like(prefix), time.time()),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def incr(self, key, amount=1, ttl=None, floor=None):
+        with self._tx() as conn:
+            current = self._get(conn, key)
+            if current is None:
+                if floor is not None and amount < 0:
+                    return floor
+                value = amount if floor is None else max(amount, floor)
+                conn.execute(
+                    "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                    (key, str(value), self._expiry(ttl)),
+                )
+                return value
+            value = int(current) + amount
+            if floor is not None:
+                value = max(value, floor)
+            if ttl:
+                conn.execute(
+                    "UPDATE kv SET value = ?, expires_at = ? WHERE key = ?",
+                    (str(value), self._expiry(ttl), key),
+                )
+            else:
+                conn.execute("UPDATE kv SET value = ? WHERE key = ?", (str(value), key))
+            return value
+
+    def rpush(self, key, value, ttl=None):
+        with self._tx() as conn:
+            row = conn.execute(
+                "SELECT expires_at FROM kv_lists WHERE key = ? ORDER BY seq LIMIT 1",
+                (key,),
+            ).fetchone()
+            if row and row[0] is not None and row[0] <= time.time():
+                conn.execute("DELETE FROM kv_lists WHERE key = ?", (key,))
+                row = None
+            expires_at = row[0] if row else self._expiry(ttl)
+            conn.execute(
+                "INSERT INTO kv_lists (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            return conn.execute("SELECT COUNT(*) FROM kv_lists WHERE key = ?", (key,)).fetchone()[0]
+
+    def lrange(self, key):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT value FROM kv_lists WHERE key = ?"
+                " AND (expires_at IS NULL OR expires_at > ?) ORDER BY seq",
+                (key, time.time()),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def purge_expired(self):
+        now = time.time()
+        with self._tx() as conn:
+            removed = conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,)).rowcount
+            removed += conn.execute("DELETE FROM kv_lists WHERE expires_at <= ?", (now,)).rowcount
+            return removed
+
+
+_DELETE_IF_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_INCR_SCRIPT = """
+local floor = tonumber(ARGV[3])
+if floor and tonumber(ARGV[1]) < 0 and redis.call('exists', KEYS[1]) == 0 then
+    return floor
+end
+local value = redis.call('incrby', KEYS[1], ARGV[1])
+if floor and value < floor then
+    value = floor
+    redis.call('set', KEYS[1], value, 'KEEPTTL')
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call('expire', KEYS[1], ARGV[2])
+end
+return value
+"""
+
+
+class RedisStore(Store):
+    """Store on any Redis-protocol server (Redis, Valkey, KeyDB, ...)."""
+
+    def __init__(self, url, prefix="voom:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("使用 redis:// 需要先安裝 redis 套件：pip install redis") from e
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._delete_if = self._redis.register_script(_DELETE_IF_SCRIPT)
+        self._incr = self._redis.register_script(_INCR_SCRIPT)
+
+    def _k(self, key):
+        return self.prefix + key
+
+    @staticmethod
+    def _ttl(ttl):
+        return max(1, int(ttl)) if ttl else None
+
+    def get(self, key):
+        return self._redis.get(self._k(key))
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self._k(key), value, ex=self._ttl(ttl))
+
+    def add(self, key, value, ttl=None):
+        return bool(self._redis.set(self._k(key), value, ex=self._ttl(ttl), nx=True))
+
+    def delete(self, key):
+        self._redis.delete(self._k(key))
+
+    def delete_if(self, key, value):
+        return bool(self._delete_if(keys=[self._k(key)], args=[value]))
+
+    def delete_prefix(self, prefix):
+        removed = 0
+        for key in self._redis.scan_iter(match=self._k(prefix) + "*", count=500):
+            removed += self._redis.delete(key)
+        return removed
+
+    def scan(self, prefix):
+        start = len(self.prefix)
+        return [key[start:] for key in self._redis.scan_iter(match=self._k(prefix) + "*", count=500)]
+
+    def incr(self, key, amount=1, ttl=None, floor=None):
+        floor = "" if floor is None else floor
+        return int(self._incr(keys=[self._k(key)], args=[amount, self._ttl(ttl) or 0, floor]))
+
+    def rpush(self, key, value, ttl=None):
+        pipe = self._redis.pipeline()
+        pipe.rpush(self._k(key), value)
+        if ttl:
+            pipe.expire(self._k(key), self._ttl(ttl), nx=True)
+        return pipe.execute()[0]
+
+    def lrange(self, key):
+        return self._redis.lrange(self._k(key), 0, -1)
+
+
+def process_alive(pid):
+    """True if ``pid`` is another live process on this host."""
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Distinguishes this process from an earlier one that had the same pid
+# (e.g. pid 1 in a restarted container).
+_INSTANCE = uuid.uuid4().hex[:12]
+
+
+def owner_id():
+    """``host:pid:instance`` naming this process as the owner of a record."""
+    return f"{socket.gethostname()}:{os.getpid()}:{_INSTANCE}"
+
+
+def owner_alive(owner):
+    """True/False for an ``owner_id`` on this host, None for one on another host."""
+    parts = (owner or "").rsplit(":", 2)
+    if len(parts) != 3 or parts[0] != socket.gethostname() or not parts[1].isdigit():
+        return None
+    if parts[2] == _INSTANCE:
+        return True
+    return process_alive(int(parts[1]))
+
+
+def default_store_url():
+    """``STORE_URL``, or a SQLite store next to the other local databases."""
+    return os.getenv("STORE_URL") or "sqlite:///" + os.getenv("VOOM_CACHE_DB", "voom_cache.sqlite3")
+
+
+def open_store(url):
+    """Build a Store from ``memory://``, ``sqlite:///path`` or ``redis://...``."""
+    if url.startswith("memory://"):
+        return MemoryStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    raise ValueError(f"不支援的 STORE_URL：{url}")
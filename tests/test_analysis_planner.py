@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from analysis_planner import BATCHED, SINGLE, AnalysisPlanner
+
+MIB = 1024 * 1024
+
+
+class AnalysisPlannerTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        self.planner = AnalysisPlanner(
+            os.path.join(tmp, "planner.sqlite3"),
+            "main-model",
+            timeout_seconds=100,
+            max_images=6,
+            max_bytes=10 * MIB,
+            min_samples=3,
+        )
+
+    def _learn(self, seconds_per_image, count=3, model_name=None):
+        for _ in range(count):
+            self.planner.record(4, 1 * MIB, 4 * seconds_per_image, model_name=model_name)
+
+    def test_static_thresholds_without_history(self):
+        self.assertIsNone(self.planner.thresholds())
+        self.assertEqual(self.planner.plan(6, 10 * MIB), SINGLE)
+        self.assertEqual(self.planner.plan(7, 1 * MIB), BATCHED)
+        self.assertEqual(self.planner.plan(2, 11 * MIB), BATCHED)
+
+    def test_learned_latency_decides(self):
+        self._learn(seconds_per_image=10)
+        # 10 s/image: 5 images predict 50 s, under 0.6 x 100 s; 7 predict 70 s.
+        self.assertEqual(self.planner.thresholds()["seconds_per_image"], 10)
+        self.assertEqual(self.planner.predict_seconds(5, 1 * MIB), 50)
+        self.assertEqual(self.planner.plan(5, 1 * MIB), SINGLE)
+        self.assertEqual(self.planner.plan(7, 1 * MIB), BATCHED)
+
+    def test_learned_latency_allows_more_than_static_limit(self):
+        self._learn(seconds_per_image=1)
+        self.assertEqual(self.planner.plan(12, 1 * MIB), SINGLE)
+
+    def test_payload_size_counts(self):
+        self._learn(seconds_per_image=1)
+        # 4 s per MiB: 20 MiB predicts 80 s.
+        self.assertEqual(self.planner.plan(2, 20 * MIB), BATCHED)
+
+    def test_image_count_that_timed_out_is_batched(self):
+        self._learn(seconds_per_image=1)
+        self.planner.record(8, 1 * MIB, 100, ok=False)
+        self.assertEqual(self.planner.thresholds()["min_failed_images"], 8)
+        self.assertEqual(self.planner.plan(7, 1 * MIB), SINGLE)
+        self.assertEqual(self.planner.plan(8, 1 * MIB), BATCHED)
+
+    def test_history_is_kept_per_model(self):
+        self._learn(seconds_per_image=30, model_name="degraded-model")
+        self.assertIsNone(self.planner.thresholds())
+        self.assertEqual(self.planner.plan(5, 1 * MIB), SINGLE)
+        self.assertEqual(self.planner.plan(5, 1 * MIB, "degraded-model"), BATCHED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import json
+import os
+import socket
+import time
+import unittest
+
+from checkpoints import ANALYZED, CRAWLED, PUBLISHED, QUEUED, JobCheckpoint, claim_orphaned
+from store import MemoryStore, owner_id
+
+
+class JobCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryStore()
+
+    def _record(self, job_id):
+        return json.loads(self.store.get(f"job:{job_id}"))
+
+    def _create(self, **kwargs):
+        checkpoint = JobCheckpoint.create(self.store, **kwargs)
+        self.addCleanup(checkpoint.stop)
+        return checkpoint
+
+    def test_stages_are_persisted(self):
+        checkpoint = self._create(url="https://voom.line.me/post/1", mode="morning")
+        self.assertEqual(checkpoint.stage, QUEUED)
+        checkpoint.crawled(["1.jpg", "2.jpg"])
+        checkpoint.save_batch("0+2", "report")
+        checkpoint.analyzed("text")
+        checkpoint.page_created("page", "https://notion.so/page")
+        checkpoint.blocks_appended(10, ["b1"])
+        checkpoint.published("https://notion.so/page")
+        record = self._record(checkpoint.job_id)
+        self.assertEqual(record["stage"], PUBLISHED)
+        self.assertEqual(record["images"], ["1.jpg", "2.jpg"])
+        self.assertEqual(record["batches"], {"0+2": "report"})
+        self.assertEqual(record["analysis"], "text")
+        self.assertEqual(record["appended"], 10)
+        self.assertEqual(record["block_ids"], ["b1"])
+        self.assertEqual(record["owner"], owner_id())
+
+    def test_lease_is_taken_at_pickup(self):
+        checkpoint = self._create()
+        self.assertIsNone(self.store.get(f"lease:job:{checkpoint.job_id}"))
+        self.assertTrue(checkpoint.acquire())
+        self.assertEqual(self.store.get(f"lease:job:{checkpoint.job_id}"), owner_id())
+
+    def test_acquire_refuses_a_job_leased_elsewhere(self):
+        checkpoint = self._create()
+        self.store.set(f"lease:job:{checkpoint.job_id}", "other-host:1:abc", ttl=60)
+        self.assertFalse(checkpoint.acquire())
+
+    def test_heartbeat_renews_lease_between_checkpoints(self):
+        checkpoint = self._create(lease_seconds=0.15)
+        checkpoint.acquire()
+        time.sleep(0.4)
+        self.assertEqual(self.store.get(f"lease:job:{checkpoint.job_id}"), owner_id())
+        checkpoint.stop()
+        time.sleep(0.25)
+        self.assertIsNone(self.store.get(f"lease:job:{checkpoint.job_id}"))
+
+    def test_heartbeat_touches_queued_record(self):
+        checkpoint = self._create(lease_seconds=0.15)
+        first = self._record(checkpoint.job_id)["updated_at"]
+        time.sleep(0.2)
+        self.assertGreater(self._record(checkpoint.job_id)["updated_at"], first)
+
+    def test_complete_forgets_the_job(self):
+        checkpoint = self._create(lease_seconds=0.06)
+        checkpoint.acquire()
+        checkpoint.complete()
+        time.sleep(0.1)
+        self.assertEqual(self.store.scan("job:"), [])
+        self.assertEqual(self.store.scan("lease:"), [])
+
+
+class ClaimOrphanedTest(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryStore()
+
+    def _claim(self, **kwargs):
+        claimed = claim_orphaned(self.store, **kwargs)
+        for checkpoint in claimed:
+            self.addCleanup(checkpoint.stop)
+        return claimed
+
+    def _orphan(self, owner, stage=CRAWLED, lease=True, updated_at=None):
+        checkpoint = JobCheckpoint.create(self.store, url="u")
+        checkpoint.stop()
+        checkpoint.crawled(["1.jpg"])
+        state = dict(checkpoint.state, owner=owner, stage=stage)
+        if updated_at is not None:
+            state["updated_at"] = updated_at
+        self.store.set(f"job:{checkpoint.job_id}", json.dumps(state))
+        if lease:
+            self.store.set(f"lease:job:{checkpoint.job_id}", owner, ttl=60)
+        else:
+            self.store.delete(f"lease:job:{checkpoint.job_id}")
+        return checkpoint.job_id
+
+    def test_own_jobs_are_not_claimed(self):
+        checkpoint = JobCheckpoint.create(self.store)
+        self.addCleanup(checkpoint.stop)
+        self.assertEqual(self._claim(), [])
+
+    def test_job_of_dead_local_process_is_claimed(self):
+        dead = f"{socket.gethostname()}:{os.getpid()}:earlier"
+        job_id = self._orphan(dead, stage=ANALYZED)
+        claimed = self._claim()
+        self.assertEqual([checkpoint.job_id for checkpoint in claimed], [job_id])
+        self.assertTrue(claimed[0].resumed)
+        self.assertEqual(claimed[0].stage, ANALYZED)
+        self.assertEqual(self.store.get(f"lease:job:{job_id}"), owner_id())
+        # A second sweep finds the job owned by this process now.
+        self.assertEqual(self._claim(), [])
+
+    def test_job_on_other_host_waits_for_its_lease(self):
+        job_id = self._orphan("other-host:1:abc", updated_at=time.time() - 1000)
+        self.assertEqual(self._claim(lease_seconds=900), [])
+        self.store.delete(f"lease:job:{job_id}")
+        self.assertEqual([c.job_id for c in self._claim(lease_seconds=900)], [job_id])
+
+    def test_queued_job_on_other_host_is_left_while_its_heartbeat_runs(self):
+        job_id = self._orphan("other-host:1:abc", stage=QUEUED, lease=False)
+        self.assertEqual(self._claim(lease_seconds=900), [])
+        stale = json.loads(self.store.get(f"job:{job_id}"))
+        stale["updated_at"] = time.time() - 1000
+        self.store.set(f"job:{job_id}", json.dumps(stale))
+        self.assertEqual([c.job_id for c in self._claim(lease_seconds=900)], [job_id])
+
+    def test_unreadable_record_is_dropped(self):
+        self.store.set("job:broken", "{not json")
+        with self.assertLogs("checkpoints", level="WARNING"):
+            self.assertEqual(self._claim(), [])
+        self.assertIsNone(self.store.get("job:broken"))
+
+
+if __name__ == "__main__":
+    unittest.main()
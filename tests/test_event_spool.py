@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from event_spool import DONE, FAILED, PENDING, PROCESSING, EventSpool
+
+
+class EventSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.path = os.path.join(self.tmp, "spool.sqlite3")
+
+    def _spool(self, handle, **kwargs):
+        spool = EventSpool(self.path, handle, **kwargs)
+        self.addCleanup(spool.shutdown, 2)
+        return spool
+
+    def _wait_for(self, predicate, timeout=3):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail("condition not reached")
+            time.sleep(0.01)
+
+    def test_handles_events_in_order(self):
+        seen = []
+        spool = self._spool(lambda body, signature: seen.append((body, signature)), workers=1)
+        spool.append("a", "sig-a")
+        spool.append("b", "sig-b")
+        spool.start()
+        self._wait_for(lambda: len(seen) == 2)
+        self.assertEqual(seen, [("a", "sig-a"), ("b", "sig-b")])
+        self._wait_for(lambda: spool.stats() == {DONE: 2})
+
+    def test_retries_then_fails(self):
+        calls = []
+
+        def handle(body, signature):
+            calls.append(body)
+            raise RuntimeError("boom")
+
+        spool = self._spool(handle, workers=1, max_attempts=3)
+        with self.assertLogs("event_spool", level="ERROR"):
+            spool.append("a", "sig")
+            spool.start()
+            self._wait_for(lambda: spool.stats() == {FAILED: 1})
+        self.assertEqual(calls, ["a", "a", "a"])
+
+    def test_recover_requeues_events_of_dead_process(self):
+        spool = self._spool(lambda body, signature: None)
+        event_id = spool.append("a", "sig")
+        # Claimed by this pid, i.e. a process that is not "another live one".
+        spool._conn.execute(
+            "UPDATE webhook_events SET status = ?, owner = ? WHERE id = ?",
+            (PROCESSING, os.getpid(), event_id),
+        )
+        with self.assertLogs("event_spool", level="WARNING"):
+            self.assertEqual(spool.recover(), 1)
+        self.assertEqual(spool.stats(), {PENDING: 1})
+
+    def test_recover_keeps_events_of_live_process(self):
+        spool = self._spool(lambda body, signature: None)
+        event_id = spool.append("a", "sig")
+        spool._conn.execute(
+            "UPDATE webhook_events SET status = ?, owner = ? WHERE id = ?",
+            (PROCESSING, os.getppid(), event_id),
+        )
+        self.assertEqual(spool.recover(), 0)
+        self.assertEqual(spool.stats(), {PROCESSING: 1})
+
+    def test_event_is_claimed_once_across_spools(self):
+        seen = []
+        lock = threading.Lock()
+
+        def handle(body, signature):
+            with lock:
+                seen.append(body)
+
+        first = self._spool(handle, workers=2)
+        second = self._spool(handle, workers=2)
+        for idx in range(20):
+            first.append(str(idx), "sig")
+        first.start()
+        second.start()
+        self._wait_for(lambda: len(seen) == 20)
+        time.sleep(0.05)
+        self.assertEqual(sorted(seen, key=int), [str(idx) for idx in range(20)])
+
+    def test_purge_done(self):
+        spool = self._spool(lambda body, signature: None, keep_done_seconds=0)
+        spool.append("a", "sig")
+        spool.start()
+        self._wait_for(lambda: spool.stats() == {DONE: 1})
+        self.assertEqual(spool.purge_done(), 1)
+        self.assertEqual(spool.stats(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
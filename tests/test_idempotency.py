@@ -0,0 +1,51 @@
+import os
+import socket
+import unittest
+
+from idempotency import IdempotencyStore
+from store import MemoryStore
+
+
+class IdempotencyStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryStore()
+        self.keys = IdempotencyStore(self.store, ttl_seconds=60, claim_ttl_seconds=10)
+
+    def test_claim_then_duplicate(self):
+        self.assertTrue(self.keys.claim(["event:1", "message:1"]))
+        self.assertFalse(self.keys.claim(["message:1"]))
+        self.assertEqual(self.keys.stats(), {"duplicates": 1})
+
+    def test_done_is_a_duplicate(self):
+        self.keys.claim(["event:1"])
+        self.keys.done(["event:1"])
+        self.assertEqual(self.store.get("idempotency:event:1"), "done")
+        self.assertFalse(self.keys.claim(["event:1"]))
+
+    def test_release_allows_retry(self):
+        self.keys.claim(["event:1"])
+        self.keys.release(["event:1"])
+        self.assertTrue(self.keys.claim(["event:1"]))
+
+    def test_partial_claim_is_rolled_back(self):
+        self.keys.claim(["message:1"])
+        self.assertFalse(self.keys.claim(["event:2", "message:1"]))
+        # event:2 was only claimed by the losing call, so it is free again.
+        self.assertTrue(self.keys.claim(["event:2"]))
+
+    def test_claim_of_dead_process_is_taken_over(self):
+        dead = f"{socket.gethostname()}:{os.getpid()}:earlier"
+        self.store.set("idempotency:event:1", f"claimed:abc:{dead}", ttl=10)
+        self.assertTrue(self.keys.claim(["event:1"]))
+
+    def test_claim_on_other_host_waits_for_expiry(self):
+        self.store.set("idempotency:event:1", "claimed:abc:other-host:1:xyz", ttl=10)
+        self.assertFalse(self.keys.claim(["event:1"]))
+
+    def test_empty_keys_are_ignored(self):
+        self.assertTrue(self.keys.claim([None, ""]))
+        self.keys.done([None])
+
+
+if __name__ == "__main__":
+    unittest.main()
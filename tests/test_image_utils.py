@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import image_utils
+from image_utils import ImagePreprocessor, image_fingerprint, sha256_file
+
+HAS_PILLOW = image_utils.Image is not None
+
+
+class ImagePreprocessorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.cache_dir = os.path.join(self.tmp, "cache")
+
+    def _image(self, name, size, mode="RGB", fmt="PNG"):
+        path = os.path.join(self.tmp, name)
+        img = image_utils.Image.effect_noise(size, 64).convert(mode)
+        img.save(path, format=fmt)
+        return path
+
+    def test_without_pillow_sends_original_bytes(self):
+        path = os.path.join(self.tmp, "1.png")
+        with open(path, "wb") as f:
+            f.write(b"not really a png")
+        original = image_utils.Image
+        image_utils.Image = None
+        try:
+            preprocessor = ImagePreprocessor(self.cache_dir)
+            self.assertFalse(preprocessor.enabled)
+            self.assertEqual(preprocessor.prepare(path), ("image/png", b"not really a png"))
+            self.assertIsNone(image_fingerprint(path)["pixels"])
+        finally:
+            image_utils.Image = original
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_unknown_format_falls_back_to_webp(self):
+        self.assertEqual(ImagePreprocessor(self.cache_dir, fmt="gif").fmt, "webp")
+
+    @unittest.skipUnless(HAS_PILLOW, "Pillow is not installed")
+    def test_downscales_and_caches(self):
+        path = self._image("1.png", (800, 400))
+        digest = sha256_file(path)
+        preprocessor = ImagePreprocessor(self.cache_dir, max_dim=200, fmt="jpeg", quality=80)
+        mime_type, data = preprocessor.prepare(path)
+        self.assertEqual(mime_type, "image/jpeg")
+        cached = preprocessor._cache_path(digest)
+        self.assertTrue(os.path.exists(cached))
+        with image_utils.Image.open(cached) as img:
+            self.assertEqual(img.size, (200, 100))
+        os.remove(path)
+        # A second call is served from the cache without reading the source.
+        self.assertEqual(preprocessor.prepare(path, digest=digest), (mime_type, data))
+
+    @unittest.skipUnless(HAS_PILLOW, "Pillow is not installed")
+    def test_keeps_original_when_reencoding_is_larger(self):
+        path = self._image("1.jpg", (32, 32), fmt="JPEG")
+        with open(path, "rb") as f:
+            raw = f.read()
+        preprocessor = ImagePreprocessor(self.cache_dir, max_dim=0, fmt="jpeg", quality=100)
+        self.assertEqual(preprocessor.prepare(path), ("image/jpeg", raw))
+
+    @unittest.skipUnless(HAS_PILLOW, "Pillow is not installed")
+    def test_undecodable_image_is_sent_as_is(self):
+        path = os.path.join(self.tmp, "broken.jpg")
+        with open(path, "wb") as f:
+            f.write(b"\xff\xd8 truncated")
+        self.assertEqual(ImagePreprocessor(self.cache_dir).prepare(path), ("image/jpeg", b"\xff\xd8 truncated"))
+
+    @unittest.skipUnless(HAS_PILLOW, "Pillow is not installed")
+    def test_pixel_hash_ignores_container(self):
+        png = self._image("1.png", (64, 64))
+        bmp = os.path.join(self.tmp, "1.bmp")
+        with image_utils.Image.open(png) as img:
+            img.save(bmp, format="BMP")
+        self.assertNotEqual(sha256_file(png), sha256_file(bmp))
+        self.assertEqual(image_fingerprint(png)["pixels"], image_fingerprint(bmp)["pixels"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import threading
+import time
+import unittest
+
+from job_queue import (
+    ACCEPTED,
+    COALESCED,
+    QUEUE_FULL,
+    SHUTTING_DOWN,
+    USER_LIMIT,
+    JobScheduler,
+    SingleFlight,
+)
+from store import MemoryStore
+
+
+class JobSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryStore()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _blocking_job(self, started=None):
+        def job():
+            if started is not None:
+                started.set()
+            self.release.wait(5)
+        return job
+
+    def _wait_for(self, predicate, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail("condition not reached")
+            time.sleep(0.01)
+
+    def test_runs_jobs(self):
+        scheduler = JobScheduler(workers=1, store=self.store)
+        done = threading.Event()
+        self.assertEqual(scheduler.submit("u", done.set), (ACCEPTED, 0))
+        self.assertTrue(done.wait(2))
+        scheduler.shutdown(timeout=2)
+
+    def test_per_user_limit(self):
+        scheduler = JobScheduler(workers=1, max_queue=5, per_user_limit=2, store=self.store)
+        self.assertEqual(scheduler.submit("u", self._blocking_job())[0], ACCEPTED)
+        self.assertEqual(scheduler.submit("u", self._blocking_job())[0], ACCEPTED)
+        self.assertEqual(scheduler.submit("u", self._blocking_job()), (USER_LIMIT, 2))
+        self.assertEqual(scheduler.submit("other", self._blocking_job())[0], ACCEPTED)
+        self.release.set()
+        scheduler.shutdown(timeout=2)
+        self.assertEqual(self.store.get("jobs:user:u"), "0")
+
+    def test_limit_shared_through_store(self):
+        first = JobScheduler(workers=1, per_user_limit=1, store=self.store)
+        second = JobScheduler(workers=1, per_user_limit=1, store=self.store)
+        self.assertEqual(first.submit("u", self._blocking_job())[0], ACCEPTED)
+        self.assertEqual(second.submit("u", self._blocking_job())[0], USER_LIMIT)
+        self.release.set()
+        first.shutdown(timeout=2)
+        second.shutdown(timeout=2)
+
+    def test_queue_full_gives_back_the_slot(self):
+        scheduler = JobScheduler(workers=1, max_queue=1, per_user_limit=5, store=self.store)
+        started = threading.Event()
+        scheduler.submit("u", self._blocking_job(started))
+        self.assertTrue(started.wait(2))
+        self.assertEqual(scheduler.submit("u", self._blocking_job())[0], ACCEPTED)
+        self.assertEqual(scheduler.submit("u", self._blocking_job())[0], QUEUE_FULL)
+        self.assertEqual(self.store.get("jobs:user:u"), "2")
+        self.release.set()
+        scheduler.shutdown(timeout=2)
+
+    def test_expired_count_does_not_go_negative(self):
+        scheduler = JobScheduler(workers=1, store=self.store, count_ttl=0.05)
+        started = threading.Event()
+        scheduler.submit("u", self._blocking_job(started))
+        self.assertTrue(started.wait(2))
+        time.sleep(0.1)
+        self.release.set()
+        scheduler.shutdown(timeout=2)
+        self.assertIsNone(self.store.get("jobs:user:u"))
+
+    def test_failing_job_releases_slot(self):
+        scheduler = JobScheduler(workers=1, per_user_limit=1, store=self.store)
+
+        def boom():
+            raise RuntimeError("boom")
+
+        with self.assertLogs("job_queue", level="ERROR"):
+            scheduler.submit("u", boom)
+            self._wait_for(lambda: self.store.get("jobs:user:u") == "0")
+        self.assertEqual(scheduler.submit("u", lambda: None)[0], ACCEPTED)
+        scheduler.shutdown(timeout=2)
+
+    def test_shutdown_drains_and_refuses(self):
+        scheduler = JobScheduler(workers=1, store=self.store)
+        ran = []
+        scheduler.submit("u", lambda: (time.sleep(0.05), ran.append(1)))
+        scheduler.submit("v", lambda: ran.append(2))
+        scheduler.shutdown(timeout=2)
+        self.assertEqual(ran, [1, 2])
+        self.assertEqual(scheduler.submit("u", lambda: None), (SHUTTING_DOWN, 0))
+        scheduler.start()
+        self.assertEqual(scheduler.submit("u", lambda: None), (SHUTTING_DOWN, 0))
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryStore()
+        self.flights = SingleFlight(self.store)
+
+    def test_coalesces_until_finish(self):
+        starts = []
+
+        def start():
+            starts.append(1)
+            return ACCEPTED, 0
+
+        self.assertEqual(self.flights.join(("post", "morning"), "a", start), (ACCEPTED, 0))
+        self.assertEqual(self.flights.join(("post", "morning"), "b", start), (COALESCED, 2))
+        self.assertEqual(self.flights.join(("post", "morning"), "b", start), (COALESCED, 2))
+        self.assertEqual(len(starts), 1)
+        self.assertEqual(len(self.flights), 1)
+        self.assertEqual(self.flights.waiters(("post", "morning")), ["a", "b"])
+        self.assertEqual(self.flights.finish(("post", "morning")), ["a", "b"])
+        self.assertEqual(len(self.flights), 0)
+        self.assertEqual(self.flights.join(("post", "morning"), "c", start), (ACCEPTED, 0))
+        self.assertEqual(len(starts), 2)
+
+    def test_rejected_start_is_not_joined(self):
+        self.assertEqual(self.flights.join("k", "a", lambda: (QUEUE_FULL, 3)), (QUEUE_FULL, 3))
+        self.assertEqual(len(self.flights), 0)
+        self.assertEqual(self.flights.join("k", "b", lambda: (ACCEPTED, 0)), (ACCEPTED, 0))
+
+    def test_raising_start_drops_the_flight(self):
+        def start():
+            raise RuntimeError("store down")
+
+        with self.assertRaises(RuntimeError):
+            self.flights.join("k", "a", start)
+        self.assertEqual(len(self.flights), 0)
+        self.assertEqual(self.flights.waiters("k"), [])
+        self.assertEqual(self.flights.join("k", "b", lambda: (ACCEPTED, 0)), (ACCEPTED, 0))
+
+    def test_expired_flight_is_not_counted(self):
+        flights = SingleFlight(self.store, ttl=0.05)
+        flights.join("k", "a", lambda: (ACCEPTED, 0))
+        time.sleep(0.1)
+        self.assertEqual(len(flights), 0)
+        self.assertEqual(flights.join("k", "b", lambda: (ACCEPTED, 0)), (ACCEPTED, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
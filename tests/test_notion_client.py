@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+
+from notion_client import NotionClient
+
+
+class _Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class NotionClientRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.client = NotionClient("token", http2=False, max_retries=2, retry_base_delay=0.5)
+        self.addCleanup(self.client.close)
+        self.calls = []
+        self.delays = []
+        sleep = mock.patch("notion_client.time.sleep", side_effect=self.delays.append)
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def _respond(self, *responses):
+        queue = list(responses)
+
+        def send(method, url, payload):
+            self.calls.append((method, url, payload))
+            return queue.pop(0)
+
+        self.client._send = send
+
+    def test_success_is_not_retried(self):
+        self._respond(_Response(200))
+        resp = self.client.request("POST", "/pages", {"a": 1})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.calls, [("POST", "https://api.notion.com/v1/pages", {"a": 1})])
+        self.assertEqual(self.client.stats()["retries"], 0)
+
+    def test_retries_with_exponential_backoff(self):
+        self._respond(_Response(502), _Response(503), _Response(200))
+        self.assertEqual(self.client.request("GET", "blocks/x").status_code, 200)
+        self.assertEqual(self.delays, [0.5, 1.0])
+        self.assertEqual(self.client.stats(), {"transport": "requests", "requests": 3, "retries": 2})
+
+    def test_honours_retry_after(self):
+        self._respond(_Response(429, {"Retry-After": "3"}), _Response(429, {"Retry-After": "soon"}), _Response(200))
+        self.client.request("PATCH", "blocks/x/children")
+        self.assertEqual(self.delays, [3.0, 1.0])
+
+    def test_gives_up_after_max_retries(self):
+        self._respond(*[_Response(429) for _ in range(3)])
+        self.assertEqual(self.client.request("POST", "pages").status_code, 429)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(len(self.delays), 2)
+
+    def test_client_errors_are_returned_at_once(self):
+        self._respond(_Response(400))
+        self.assertEqual(self.client.request("POST", "pages").status_code, 400)
+        self.assertEqual(self.delays, [])
+
+    def test_absolute_urls_are_kept(self):
+        self._respond(_Response(200))
+        self.client.request("DELETE", "https://example.com/v1/blocks/x")
+        self.assertEqual(self.calls[0][1], "https://example.com/v1/blocks/x")
+
+
+if __name__ == "__main__":
+    unittest.main()
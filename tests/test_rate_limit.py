@@ -0,0 +1,50 @@
+import threading
+import time
+import unittest
+
+from rate_limit import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_disabled_never_waits(self):
+        for per_minute in (0, -1, None):
+            limiter = RateLimiter(per_minute)
+            self.assertEqual([limiter.acquire() for _ in range(3)], [0.0, 0.0, 0.0])
+
+    def test_spaces_calls(self):
+        limiter = RateLimiter(600)  # one call per 0.1 s
+        started = time.monotonic()
+        self.assertEqual(limiter.acquire(), 0)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+    def test_idle_time_is_not_banked(self):
+        limiter = RateLimiter(600)
+        limiter.acquire()
+        time.sleep(0.25)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertGreater(limiter.acquire(), 0.05)
+
+    def test_threads_get_distinct_slots(self):
+        limiter = RateLimiter(1200)  # 0.05 s apart
+        starts = []
+        lock = threading.Lock()
+
+        def call():
+            limiter.acquire()
+            with lock:
+                starts.append(time.monotonic())
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        starts.sort()
+        gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+        self.assertTrue(all(gap >= 0.04 for gap in gaps), gaps)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from result_cache import AnalysisCache, ResultCache, voom_post_id
+from store import MemoryStore
+
+
+class VoomPostIdTest(unittest.TestCase):
+    def test_urls_and_ids_normalize_to_the_post_id(self):
+        for value in (
+            "https://voom.line.me/post/1169ABC",
+            "https://linevoom.line.me/post/1169ABC?utm_source=share#top",
+            "  https://voom.line.me/post/1169ABC/  ",
+            "1169ABC/",
+            "1169ABC",
+        ):
+            self.assertEqual(voom_post_id(value), "1169ABC", value)
+
+    def test_empty(self):
+        self.assertEqual(voom_post_id(None), "")
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResultCache(MemoryStore(), ttl_seconds=60)
+
+    def test_entries_are_keyed_by_mode_prompt_and_model(self):
+        self.cache.put("p1", "full", "v1", "model-a", "https://notion.so/a")
+        self.assertEqual(self.cache.get("p1", "full", "v1", "model-a"), "https://notion.so/a")
+        self.assertIsNone(self.cache.get("p1", "brief", "v1", "model-a"))
+        self.assertIsNone(self.cache.get("p1", "full", "v2", "model-a"))
+        self.assertIsNone(self.cache.get("p1", "full", "v1", "model-b"))
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 3, "hit_rate": 0.25})
+
+    def test_invalidate_keeps_counters(self):
+        self.cache.put("p1", "full", "v1", "m", "u1")
+        self.cache.put("p10", "full", "v1", "m", "u10")
+        self.cache.get("p1", "full", "v1", "m")
+        self.assertEqual(self.cache.invalidate("p1"), 1)
+        self.assertEqual(self.cache.get("p10", "full", "v1", "m"), "u10")
+        self.assertEqual(self.cache.invalidate(), 1)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+
+class AnalysisCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = AnalysisCache(MemoryStore(), ttl_seconds=60)
+        self.images = [{"sha256": "a1", "pixels": "p1"}, {"sha256": "a2", "pixels": "p2"}]
+
+    def test_keys_depend_on_prompt_model_and_image_order(self):
+        keys = AnalysisCache.keys_for("prompt", "model", self.images)
+        self.assertEqual([key.split(":")[0] for key in keys], ["sha256", "pixels"])
+        self.assertEqual(keys, AnalysisCache.keys_for("prompt", "model", list(self.images)))
+        self.assertNotEqual(keys, AnalysisCache.keys_for("prompt 2", "model", self.images))
+        self.assertNotEqual(keys, AnalysisCache.keys_for("prompt", "model 2", self.images))
+        self.assertNotEqual(keys, AnalysisCache.keys_for("prompt", "model", self.images[::-1]))
+
+    def test_pixel_key_needs_every_pixel_hash(self):
+        images = [{"sha256": "a1", "pixels": "p1"}, {"sha256": "a2", "pixels": None}]
+        keys = AnalysisCache.keys_for("prompt", "model", images)
+        self.assertEqual([key.split(":")[0] for key in keys], ["sha256"])
+        self.assertEqual(AnalysisCache.keys_for("prompt", "model", []), [])
+
+    def test_pixel_identical_copy_is_a_hit(self):
+        self.cache.put(AnalysisCache.keys_for("prompt", "model", self.images), "analysis")
+        resaved = [{"sha256": "b1", "pixels": "p1"}, {"sha256": "b2", "pixels": "p2"}]
+        self.assertEqual(self.cache.get(AnalysisCache.keys_for("prompt", "model", resaved)), "analysis")
+        changed = [{"sha256": "b1", "pixels": "p1"}, {"sha256": "b2", "pixels": "p3"}]
+        self.assertIsNone(self.cache.get(AnalysisCache.keys_for("prompt", "model", changed)))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from store import MemoryStore, SQLiteStore, Store, open_store, owner_alive, owner_id
+
+
+class StoreContract:
+    """Behaviour every Store backend must share."""
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_set_get_delete(self):
+        self.store.set("a", "1")
+        self.assertEqual(self.store.get("a"), "1")
+        self.store.delete("a")
+        self.assertIsNone(self.store.get("a"))
+
+    def test_ttl_expires(self):
+        self.store.set("a", "1", ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.store.get("a"))
+
+    def test_add_only_when_absent(self):
+        self.assertTrue(self.store.add("a", "first"))
+        self.assertFalse(self.store.add("a", "second"))
+        self.assertEqual(self.store.get("a"), "first")
+
+    def test_add_after_expiry(self):
+        self.store.add("a", "first", ttl=0.05)
+        time.sleep(0.1)
+        self.assertTrue(self.store.add("a", "second"))
+
+    def test_delete_if(self):
+        self.store.set("a", "mine")
+        self.assertFalse(self.store.delete_if("a", "theirs"))
+        self.assertTrue(self.store.delete_if("a", "mine"))
+        self.assertIsNone(self.store.get("a"))
+
+    def test_scan_and_delete_prefix(self):
+        self.store.set("result:1", "x")
+        self.store.set("result:2", "y")
+        self.store.set("results", "z")
+        self.store.set("result:old", "w", ttl=0.05)
+        time.sleep(0.1)
+        self.assertEqual(sorted(self.store.scan("result:")), ["result:1", "result:2"])
+        self.store.delete_prefix("result:")
+        self.assertEqual(self.store.scan("result:"), [])
+        self.assertEqual(self.store.get("results"), "z")
+
+    def test_scan_escapes_wildcards(self):
+        self.store.set("a_b", "1")
+        self.store.set("axb", "2")
+        self.assertEqual(self.store.scan("a_"), ["a_b"])
+
+    def test_incr(self):
+        self.assertEqual(self.store.incr("n"), 1)
+        self.assertEqual(self.store.incr("n", 4), 5)
+        self.assertEqual(self.store.incr("n", -2), 3)
+
+    def test_incr_refreshes_ttl(self):
+        self.store.incr("n", ttl=0.2)
+        time.sleep(0.12)
+        self.store.incr("n", ttl=0.2)
+        time.sleep(0.12)
+        self.assertEqual(self.store.get("n"), "2")
+        time.sleep(0.15)
+        self.assertIsNone(self.store.get("n"))
+
+    def test_incr_without_ttl_keeps_expiry(self):
+        self.store.incr("n", ttl=0.1)
+        self.store.incr("n")
+        time.sleep(0.15)
+        self.assertIsNone(self.store.get("n"))
+
+    def test_incr_floor(self):
+        self.store.incr("n", 2)
+        self.assertEqual(self.store.incr("n", -5, floor=0), 0)
+        self.assertEqual(self.store.get("n"), "0")
+
+    def test_decrement_with_floor_does_not_create_key(self):
+        self.assertEqual(self.store.incr("n", -1, ttl=10, floor=0), 0)
+        self.assertIsNone(self.store.get("n"))
+        self.assertEqual(self.store.scan("n"), [])
+
+    def test_lists(self):
+        self.assertEqual(self.store.lrange("l"), [])
+        self.store.rpush("l", "a", ttl=10)
+        self.store.rpush("l", "b")
+        self.assertEqual(self.store.lrange("l"), ["a", "b"])
+        self.store.delete("l")
+        self.assertEqual(self.store.lrange("l"), [])
+
+    def test_list_ttl_expires(self):
+        self.store.rpush("l", "a", ttl=0.05)
+        time.sleep(0.1)
+        self.assertEqual(self.store.lrange("l"), [])
+
+    def test_purge_expired(self):
+        self.store.set("gone", "1", ttl=0.05)
+        self.store.rpush("gone-list", "1", ttl=0.05)
+        self.store.set("kept", "1")
+        time.sleep(0.1)
+        self.assertEqual(self.store.purge_expired(), 2)
+        self.assertEqual(self.store.get("kept"), "1")
+
+    def test_lock_excludes(self):
+        with self.store.lock("job"):
+            with self.assertRaises(TimeoutError):
+                with self.store.lock("job", timeout=0.1):
+                    pass
+        with self.store.lock("job", timeout=0.1):
+            pass
+
+    def test_lock_expires_when_holder_dies(self):
+        self.store.add("lock:job", "dead-holder", ttl=0.05)
+        with self.store.lock("job", timeout=1):
+            pass
+
+    def test_lock_serializes_threads(self):
+        self.store.set("n", "0")
+        errors = []
+
+        def bump():
+            try:
+                for _ in range(20):
+                    with self.store.lock("n", timeout=5, poll=0.001):
+                        value = int(self.store.get("n"))
+                        self.store.set("n", str(value + 1))
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.store.get("n"), "80")
+
+
+class MemoryStoreTest(StoreContract, unittest.TestCase):
+    def make_store(self):
+        return MemoryStore()
+
+
+class SQLiteStoreTest(StoreContract, unittest.TestCase):
+    def make_store(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        return SQLiteStore(os.path.join(self.tmp, "store.sqlite3"))
+
+    def test_shared_between_connections(self):
+        other = SQLiteStore(self.store.path)
+        self.store.set("a", "1")
+        self.assertEqual(other.get("a"), "1")
+        self.assertFalse(other.add("a", "2"))
+
+
+class StoreHelpersTest(unittest.TestCase):
+    def test_store_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Store()
+
+    def test_open_store(self):
+        self.assertIsInstance(open_store("memory://"), MemoryStore)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        path = os.path.join(tmp, "s.sqlite3")
+        self.assertIsInstance(open_store("sqlite:///" + path), SQLiteStore)
+
+    def test_owner_alive(self):
+        self.assertTrue(owner_alive(owner_id()))
+        host = owner_id().split(":")[0]
+        # Same pid, different instance: an earlier process that reused the pid.
+        self.assertFalse(owner_alive(f"{host}:{os.getpid()}:earlier"))
+        self.assertIsNone(owner_alive("some-other-host:1:abc"))
+        self.assertIsNone(owner_alive(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
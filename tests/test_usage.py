@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from store import MemoryStore
+from usage import DAILY_EXCEEDED, OK, USER_EXCEEDED, JobUsage, UsageLedger, user_label
+
+
+def _metadata(prompt, output):
+    return SimpleNamespace(
+        prompt_token_count=prompt,
+        candidates_token_count=output,
+        total_token_count=prompt + output,
+    )
+
+
+class UsageLedgerTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        self.path = os.path.join(tmp, "usage.sqlite3")
+
+    def test_summary_hides_user_ids(self):
+        ledger = UsageLedger(self.path)
+        ledger.record(JobUsage("U1234567890abcdef", "morning", job_id="job-1"), "model", _metadata(10, 5))
+        summary = ledger.summary()
+        self.assertNotIn("U1234567890abcdef", repr(summary))
+        label = user_label("U1234567890abcdef")
+        self.assertEqual(summary["by_user"][label]["total_tokens"], 15)
+        self.assertEqual(summary["recent_jobs"][0]["user"], label)
+        self.assertEqual(summary["today"]["calls"], 1)
+
+    def test_user_label(self):
+        self.assertEqual(user_label("U1"), user_label("U1"))
+        self.assertNotEqual(user_label("U1"), user_label("U2"))
+        self.assertEqual(user_label(None), "-")
+
+    def test_budgets(self):
+        ledger = UsageLedger(self.path, user_daily_budget=20, daily_budget=50, store=MemoryStore())
+        ledger.record(JobUsage("a", "morning"), "model", _metadata(15, 10))
+        self.assertEqual(ledger.budget_status("a"), USER_EXCEEDED)
+        self.assertEqual(ledger.budget_status("b"), OK)
+        ledger.record(JobUsage("b", "morning"), "model", _metadata(20, 10))
+        self.assertEqual(ledger.budget_status("b"), DAILY_EXCEEDED)
+
+    def test_job_usage_totals(self):
+        ledger = UsageLedger(self.path)
+        job = JobUsage("a", "morning")
+        ledger.record(job, "model", _metadata(3, 2))
+        ledger.record(job, "model", _metadata(4, 1))
+        self.assertEqual((job.prompt_tokens, job.output_tokens, job.total_tokens, job.calls), (7, 3, 10, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
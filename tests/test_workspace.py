@@ -0,0 +1,93 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from workspace import ACTIVE_MARKER, JobWorkspace, _natural_key, sweep_expired_workspaces
+
+
+def _touch(path, mtime=None):
+    with open(path, "w") as f:
+        f.write("x")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+class JobWorkspaceTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+
+    def test_removed_after_job_without_ttl(self):
+        with JobWorkspace(self.root, job_id="job") as workspace:
+            self.assertTrue(os.path.exists(os.path.join(workspace.path, ACTIVE_MARKER)))
+        self.assertFalse(os.path.exists(workspace.path))
+
+    def test_kept_after_job_with_ttl(self):
+        with JobWorkspace(self.root, job_id="job", ttl_seconds=60) as workspace:
+            pass
+        self.assertTrue(os.path.isdir(workspace.path))
+        self.assertFalse(os.path.exists(os.path.join(workspace.path, ACTIVE_MARKER)))
+
+    def test_image_paths_in_natural_order(self):
+        with JobWorkspace(self.root, job_id="job") as workspace:
+            for name in ("10.jpg", "2.jpg", "1.jpg", "cover.jpg"):
+                _touch(os.path.join(workspace.path, name))
+            names = [os.path.basename(path) for path in workspace.image_paths()]
+            self.assertEqual(names, ["1.jpg", "2.jpg", "10.jpg", "cover.jpg"])
+            self.assertEqual(len(workspace.image_paths(limit=2)), 2)
+
+    def test_natural_key(self):
+        paths = ["b.png", "3.png", "a.png", "20.png"]
+        self.assertEqual(sorted(paths, key=_natural_key), ["3.png", "20.png", "a.png", "b.png"])
+
+
+class SweepExpiredWorkspacesTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.now = time.time()
+
+    def _workspace(self, name, age, owner_pid=None):
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        if owner_pid is not None:
+            with open(os.path.join(path, ACTIVE_MARKER), "w") as f:
+                f.write(str(owner_pid))
+        mtime = self.now - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_removes_only_expired_finished_workspaces(self):
+        old = self._workspace("old", age=120)
+        fresh = self._workspace("fresh", age=10)
+        self.assertEqual(sweep_expired_workspaces(self.root, 60, now=self.now), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_active_workspaces_are_skipped(self):
+        running = self._workspace("running", age=120, owner_pid=os.getpid())
+        self.assertEqual(sweep_expired_workspaces(self.root, 60, now=self.now), 0)
+        self.assertTrue(os.path.exists(running))
+
+    def test_startup_sweep_removes_orphans_but_not_live_owners(self):
+        # This pid counts as gone (a previous run of this process).
+        orphan = self._workspace("orphan", age=1, owner_pid=os.getpid())
+        live = self._workspace("live", age=1, owner_pid=os.getppid())
+        resumed = self._workspace("resumed", age=1, owner_pid=os.getpid())
+        removed = sweep_expired_workspaces(
+            self.root, 60, now=self.now, include_active=True, keep={"resumed"}
+        )
+        self.assertEqual(removed, 1)
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(live))
+        self.assertTrue(os.path.exists(resumed))
+
+    def test_missing_root(self):
+        self.assertEqual(sweep_expired_workspaces(os.path.join(self.root, "none"), 60), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import date
+
+OK = "ok"
+USER_EXCEEDED = "user_exceeded"
+DAILY_EXCEEDED = "daily_exceeded"
+
+
+def user_label(user_key):
+    """Stable pseudonym for a LINE user/group id, for output that leaves the host."""
+    if not user_key:
+        return "-"
+    return "user-" + hashlib.sha256(user_key.encode("utf-8")).hexdigest()[:12]
+
+
+class JobUsage:
+    """Token usage context for one VOOM job.
+
+    ``degraded`` is set when the job started over budget and should run on
+    the cheaper model and smaller images.
+    """
+
+    def __init__(self, user_key, mode, job_id=None, degraded=False):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.user_key = user_key
+        self.mode = mode
+        self.degraded = degraded
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.total_tokens = 0
+        self.calls = 0
+
+
+class UsageLedger:
+    """Per-call Gemini token counts, aggregated per job, user, mode and day.
+
+    The detailed ledger is local to this host; the daily totals that budgets
+    are checked against are also kept in ``store`` when one is shared, so
+    every worker enforces the same budget.
+    """
+
+    def __init__(self, path, user_daily_budget=0, daily_budget=0, store=None):
+        self.store = store
+        self.user_daily_budget = user_daily_budget
+        self.daily_budget = daily_budget
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_usage ("
+            " day TEXT NOT NULL,"
+            " job_id TEXT NOT NULL,"
+            " user_key TEXT,"
+            " mode TEXT,"
+            " model TEXT NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL,"
+            " output_tokens INTEGER NOT NULL,"
+            " total_tokens INTEGER NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS token_usage_day_user ON token_usage (day, user_key)"
+        )
+        self._conn.commit()
+
+    def record(self, job_usage, model_name, usage_metadata):
+        prompt = getattr(usage_metadata, "prompt_token_count", 0) or 0
+        output = getattr(usage_metadata, "candidates_token_count", 0) or 0
+        total = getattr(usage_metadata, "total_token_count", 0) or (prompt + output)
+        job_id = job_usage.job_id if job_usage else "-"
+        user_key = job_usage.user_key if job_usage else None
+        mode = job_usage.mode if job_usage else None
+        if job_usage:
+            job_usage.prompt_tokens += prompt
+            job_usage.output_tokens += output
+            job_usage.total_tokens += total
+            job_usage.calls += 1
+        if self.store is not None and total:
+            today = date.today().isoformat()
+            self.store.incr(f"tokens:{today}", total, ttl=2 * 24 * 3600)
+            if user_key is not None:
+                self.store.incr(f"tokens:{today}:{user_key}", total, ttl=2 * 24 * 3600)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO token_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    date.today().isoformat(),
+                    job_id,
+                    user_key,
+                    mode,
+                    model_name,
+                    prompt,
+                    output,
+                    total,
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def _sum(self, where, params):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COALESCE(SUM(total_tokens), 0) FROM token_usage WHERE {where}",
+                params,
+            ).fetchone()
+        return row[0]
+
+    def _daily_total(self, today, user_key=None):
+        if self.store is not None:
+            key = f"tokens:{today}" if user_key is None else f"tokens:{today}:{user_key}"
+            return int(self.store.get(key) or 0)
+        if user_key is None:
+            return self._sum("day = ?", (today,))
+        return self._sum("day = ? AND user_key = ?", (today, user_key))
+
+    def budget_status(self, user_key):
+        today = date.today().isoformat()
+        if self.daily_budget > 0 and self._daily_total(today) >= self.daily_budget:
+            return DAILY_EXCEEDED
+        if (
+            self.user_daily_budget > 0
+            and user_key is not None
+            and self._daily_total(today, user_key) >= self.user_daily_budget
+        ):
+            return USER_EXCEEDED
+        return OK
+
+    def summary(self, recent_jobs=20):
+        """Today's usage for ``/metrics``; user ids are replaced by ``user_label``."""
+        today = date.today().isoformat()
+        columns = (
+            "COUNT(*), SUM(prompt_tokens), SUM(output_tokens), SUM(total_tokens)"
+        )
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT {columns} FROM token_usage WHERE day = ?", (today,)
+            ).fetchone()
+            by_user = self._conn.execute(
+                f"SELECT user_key, {columns} FROM token_usage WHERE day = ? GROUP BY user_key",
+                (today,),
+            ).fetchall()
+            by_mode = self._conn.execute(
+                f"SELECT mode, {columns} FROM token_usage WHERE day = ? GROUP BY mode",
+                (today,),
+            ).fetchall()
+            jobs = self._conn.execute(
+                f"SELECT job_id, user_key, mode, {columns}, MAX(created_at) AS last"
+                " FROM token_usage GROUP BY job_id ORDER BY last DESC LIMIT ?",
+                (recent_jobs,),
+            ).fetchall()
+
+        def counts(row):
+            calls, prompt, output, total_tokens = row
+            return {
+                "calls": calls,
+                "prompt_tokens": prompt or 0,
+                "output_tokens": output or 0,
+                "total_tokens": total_tokens or 0,
+            }
+
+        return {
+            "day": today,
+            "today": counts(total),
+            "by_user": {user_label(row[0]): counts(row[1:]) for row in by_user},
+            "by_mode": {row[0] or "-": counts(row[1:]) for row in by_mode},
+            "recent_jobs": [
+                {"job_id": row[0], "user": user_label(row[1]), "mode": row[2], **counts(row[3:7])}
+                for row in jobs
+            ],
+            "budgets": {
+                "daily": self.daily_budget,
+                "user_daily": self.user_daily_budget,
+            },
+        }
@@ -1,27 +1,315 @@
-﻿import sys
+import argparse
 import os
+import shlex
+import sys
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 from playwright.sync_api import sync_playwright
 
-if len(sys.argv) < 2:
-    print("用法: python voom_downloader.py <LINE VOOM 文章網址>")
-    sys.exit(1)
+SAVE_DIR = "voom_images"
 
-url = sys.argv[1]
 
-SAVE_DIR = "voom_images"
-os.makedirs(SAVE_DIR, exist_ok=True)
+class CrawlTimeout(TimeoutError):
+    """The crawl ran past its deadline."""
+
+
+def _past(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _check_deadline(deadline):
+    if _past(deadline):
+        raise CrawlTimeout("爬取 VOOM 圖片逾時")
+
+def _env_int(name, default):
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+def _env_flag(name, default="1"):
+    return os.getenv(name, default) not in ("0", "false", "False")
+
+# 圖片下載並行數與每個 host 的連線上限（line-scdn CDN）
+FETCH_CONCURRENCY = _env_int("VOOM_FETCH_CONCURRENCY", 6)
+FETCH_PER_HOST = _env_int("VOOM_FETCH_PER_HOST", 4)
+# 切換下一張時等待 swiper 實際移動的上限（毫秒）
+SLIDE_CHANGE_TIMEOUT_MS = _env_int("VOOM_SLIDE_CHANGE_TIMEOUT_MS", 3000)
+# 先從 DOM 一次取出所有 slide 圖片網址，數量對不上才逐張點檢視器
+FAST_MODE = _env_flag("VOOM_FAST_MODE")
+# 直接保存瀏覽器已下載的圖片內容，不再用 requests 重抓一次
+CAPTURE_RESPONSES = _env_flag("VOOM_CAPTURE_RESPONSES")
+
+# 瀏覽器啟動設定（伺服器部署預設 headless）
+HEADLESS = _env_flag("VOOM_HEADLESS")
+VIEWPORT = os.getenv("VOOM_VIEWPORT", "1280x900")
+DEVICE_SCALE_FACTOR = os.getenv("VOOM_DEVICE_SCALE_FACTOR", "1")
+LOCALE = os.getenv("VOOM_LOCALE", "zh-TW")
+USER_AGENT = os.getenv("VOOM_USER_AGENT") or None
+CHROMIUM_ARGS = os.getenv("VOOM_CHROMIUM_ARGS", "--disable-gpu --disable-dev-shm-usage")
+
+# 資源封鎖設定：off / standard / strict
+BLOCK_PROFILE = os.getenv("VOOM_BLOCK_PROFILE", "standard")
+
+_TRACKER_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "googlesyndication.com",
+    "facebook.net",
+    "tr.line.me",
+)
+_FIRST_PARTY_HOSTS = ("line.me", "line-scdn.net", "line-apps.com")
 
-def download_image(img_url, idx):
+BLOCK_PROFILES = {
+    "off": {},
+    "standard": {
+        "resource_types": {"font", "media"},
+        "block_trackers": True,
+        "block_third_party_scripts": False,
+        "blocked_hosts": (),
+    },
+    "strict": {
+        "resource_types": {"font", "media", "websocket", "manifest", "texttrack", "eventsource"},
+        "block_trackers": True,
+        "block_third_party_scripts": True,
+        # Avatars and stickers are never part of the post's media
+        "blocked_hosts": ("profile.line-scdn.net", "stickershop.line-scdn.net"),
+    },
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    # Shared keep-alive session so consecutive crawls reuse CDN connections
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=max(FETCH_CONCURRENCY, FETCH_PER_HOST),
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def save_image_bytes(img_url, idx, save_dir, data):
     parsed = urlparse(img_url)
     ext = os.path.splitext(parsed.path)[1] or ".jpg"
-    r = requests.get(img_url, timeout=30)
+    path = os.path.join(save_dir, f"{idx}{ext}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def download_image(img_url, idx, save_dir=SAVE_DIR, session=None):
+    r = (session or get_session()).get(img_url, timeout=30)
     r.raise_for_status()
-    with open(os.path.join(SAVE_DIR, f"{idx}{ext}"), "wb") as f:
-        f.write(r.content)
+    return save_image_bytes(img_url, idx, save_dir, r.content)
+
+class ResponseCapture:
+    """Remembers line-scdn image responses the page has already received.
+
+    Only the Response handles are stored; bodies are read lazily with
+    ``body_for`` on the crawl thread, since Playwright's sync objects must not
+    be touched from the fetcher threads.
+    """
+
+    def __init__(self, page):
+        self._responses = {}
+        self._page = page
+        page.on("response", self._on_response)
+
+    def _on_response(self, response):
+        try:
+            if "line-scdn" not in response.url:
+                return
+            if response.request.resource_type != "image" or not response.ok:
+                return
+        except Exception:
+            return
+        self._responses[response.url] = response
+
+    def body_for(self, img_url):
+        response = self._responses.get(img_url)
+        if response is None:
+            return None
+        try:
+            return response.body()
+        except Exception:
+            # Body may already be evicted from the browser cache
+            return None
+
+    def close(self):
+        try:
+            self._page.remove_listener("response", self._on_response)
+        except Exception:
+            pass
+        self._responses.clear()
+
+class ImageFetcher:
+    """Downloads image URLs concurrently while the crawler keeps walking slides.
+
+    ``submit`` returns immediately; ``wait`` blocks until every submitted
+    image is saved and returns the paths in submission order. ``on_saved``,
+    if given, is called as ``on_saved(path, idx)`` as soon as each image is
+    on disk, from whichever thread saved it.
+    """
+
+    def __init__(self, save_dir, concurrency=FETCH_CONCURRENCY, per_host=FETCH_PER_HOST, capture=None, on_saved=None):
+        self.save_dir = save_dir
+        self.per_host = per_host
+        self.capture = capture
+        self.on_saved = on_saved
+        self._session = get_session()
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency,
+            thread_name_prefix="voom-fetch",
+        )
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self._futures = []
+        self._closed = False
+
+    def _host_semaphore(self, img_url):
+        host = urlparse(img_url).netloc
+        with self._lock:
+            sem = self._host_limits.get(host)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.per_host)
+                self._host_limits[host] = sem
+            return sem
+
+    def _fetch(self, img_url, idx):
+        with self._host_semaphore(img_url):
+            return download_image(img_url, idx, self.save_dir, self._session)
+
+    def submit(self, img_url, idx):
+        data = self.capture.body_for(img_url) if self.capture else None
+        if data:
+            print(f"保存第 {idx} 張（瀏覽器已下載）...")
+            future = Future()
+            try:
+                future.set_result(save_image_bytes(img_url, idx, self.save_dir, data))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            print(f"下載第 {idx} 張...")
+            future = self._executor.submit(self._fetch, img_url, idx)
+        if self.on_saved:
+            future.add_done_callback(lambda f: self._notify_saved(f, idx))
+        self._futures.append(future)
+        return future
+
+    def _notify_saved(self, future, idx):
+        # A crawl that was given up on must not feed its caller any more images.
+        if self._closed or future.cancelled() or future.exception() is not None:
+            return
+        try:
+            self.on_saved(future.result(), idx)
+        except Exception as e:
+            print(f"[warn] on_saved 失敗 (第 {idx} 張): {e}")
+
+    def wait(self, deadline=None):
+        paths = []
+        for future in self._futures:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                paths.append(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                self.close()
+                raise CrawlTimeout("下載 VOOM 圖片逾時") from None
+            except BaseException:
+                self.close()
+                raise
+        self._executor.shutdown(wait=True)
+        return paths
+
+    def close(self):
+        self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def _parse_viewport(value):
+    try:
+        width, height = value.lower().split("x", 1)
+        return {"width": int(width), "height": int(height)}
+    except (AttributeError, ValueError):
+        print(f"[warn] 無效的 viewport {value!r}，使用 1280x900")
+        return {"width": 1280, "height": 900}
+
+def _parse_scale(value):
+    try:
+        scale = float(value)
+    except (TypeError, ValueError):
+        scale = 0.0
+    if scale <= 0:
+        print(f"[warn] 無效的 device scale factor {value!r}，使用 1")
+        return 1.0
+    return scale
+
+def launch_options(headless=HEADLESS, chromium_args=CHROMIUM_ARGS):
+    """Keyword arguments for ``chromium.launch``."""
+    return {
+        "headless": headless,
+        "args": shlex.split(chromium_args or ""),
+    }
+
+def context_options(viewport=VIEWPORT, scale=DEVICE_SCALE_FACTOR, locale=LOCALE, user_agent=USER_AGENT):
+    """Keyword arguments for ``browser.new_context``."""
+    options = {
+        "viewport": _parse_viewport(viewport),
+        "device_scale_factor": _parse_scale(scale),
+    }
+    if locale:
+        options["locale"] = locale
+    if user_agent:
+        options["user_agent"] = user_agent
+    return options
+
+def _host_matches(url, hosts):
+    # Compare the hostname only: a first-party URL may carry a tracker's
+    # domain in its path or query.
+    hostname = (urlparse(url).hostname or "").lower()
+    return any(hostname == host or hostname.endswith("." + host) for host in hosts)
+
+def install_block_profile(page, profile_name=BLOCK_PROFILE):
+    """Abort requests the swiper does not need according to ``BLOCK_PROFILES``."""
+    profile = BLOCK_PROFILES.get(profile_name)
+    if profile is None:
+        print(f"[warn] 未知的 VOOM_BLOCK_PROFILE={profile_name!r}，不封鎖資源")
+        return
+    if not profile:
+        return
+
+    def handle_route(route):
+        request = route.request
+        url = request.url
+        resource_type = request.resource_type
+        blocked = (
+            resource_type in profile["resource_types"]
+            or (profile["block_trackers"] and _host_matches(url, _TRACKER_HOSTS))
+            or _host_matches(url, profile["blocked_hosts"])
+            or (
+                profile["block_third_party_scripts"]
+                and resource_type == "script"
+                and not _host_matches(url, _FIRST_PARTY_HOSTS)
+            )
+        )
+        if blocked:
+            route.abort()
+        else:
+            route.continue_()
+
+    page.route("**/*", handle_route)
 
 def pick_largest_image(page, candidates):
     best = None
@@ -71,6 +359,26 @@ def get_active_viewer_info(page):
     src = img.get_attribute("src") or img.get_attribute("data-src")
     return img, src, None
 
+def wait_for_slide_change(page, prev_idx, prev_src, timeout=SLIDE_CHANGE_TIMEOUT_MS):
+    # Resolve as soon as the active viewer slide index (or its image) differs
+    try:
+        page.wait_for_function(
+            """([prevIdx, prevSrc]) => {
+                const slide = document.querySelector('.vw_media_viewer .swiper-slide-active');
+                if (!slide) return false;
+                const idx = slide.getAttribute('data-swiper-slide-index');
+                if (prevIdx !== null && idx !== null) return idx !== prevIdx;
+                const img = slide.querySelector('.vw_media_viewer_item img');
+                const src = img ? (img.getAttribute('src') || img.getAttribute('data-src')) : null;
+                return !!src && src !== prevSrc;
+            }""",
+            arg=[prev_idx, prev_src],
+            timeout=timeout,
+        )
+        return True
+    except Exception:
+        return False
+
 def get_viewer_unique_indices(page):
     try:
         indices = page.eval_on_selector_all(
@@ -122,27 +430,68 @@ def collect_slide_image_urls(page):
             ordered.append(u)
     return ordered
 
+def collect_indexed_slide_urls(page):
+    # One round trip: map every inline swiper slide index to its image url.
+    # Loop-mode swipers duplicate slides, so dedupe by index and keep index order.
+    try:
+        pairs = page.eval_on_selector_all(
+            ".media_layout .swiper-slide",
+            """els => els.map(e => {
+                const img = e.querySelector("img.media_image, img[src*='line-scdn']");
+                return [
+                    e.getAttribute('data-swiper-slide-index'),
+                    img ? (img.getAttribute('src') || img.getAttribute('data-src')) : null,
+                ];
+            })"""
+        )
+    except Exception:
+        return [], []
+    by_index = {}
+    for idx, src in pairs or []:
+        if idx is None or idx in by_index:
+            continue
+        by_index[idx] = src
+    indices = sorted(by_index, key=lambda v: int(v) if v.isdigit() else v)
+    urls = [by_index[idx] for idx in indices if by_index[idx]]
+    return indices, urls
+
+def collect_single_image_urls(page):
+    # One-image posts render the image without a swiper; these are the same
+    # containers find_viewer_target falls back to.
+    urls = []
+    imgs = page.query_selector_all(
+        ".vw_viewer_content_wrap .media_layout img.media_image, "
+        ".media_top_inner img.media_image"
+    )
+    for img in imgs:
+        src = img.get_attribute("src") or img.get_attribute("data-src")
+        if src and src not in urls:
+            urls.append(src)
+    return urls
+
+def fast_collect(page, fetcher):
+    """Queue all slide images straight from the DOM; return False to request the viewer walk."""
+    indices, urls = collect_indexed_slide_urls(page)
+    if not indices:
+        # Single-image posts have no swiper slides to index.
+        urls = collect_single_image_urls(page)
+        if len(urls) != 1:
+            return False
+    elif len(set(urls)) != len(indices):
+        print(f"DOM 取得 {len(urls)} 張，swiper 有 {len(indices)} 張，改用檢視器逐張下載。")
+        return False
+    print(f"快速模式：從 DOM 取得 {len(urls)} 張")
+    for i, src in enumerate(urls, start=1):
+        fetcher.submit(src, i)
+    return True
+
 def get_active_slide_src(page):
     img = page.query_selector(".swiper-slide-active img.media_image, .swiper-slide-active img[src*='line-scdn']")
     if not img:
         return None
     return img.get_attribute("src")
 
-with sync_playwright() as p:
-    browser = p.chromium.launch(headless=False)
-    context = browser.new_context()
-    page = context.new_page()
-
-    print("啟動瀏覽器並打開 LINE VOOM 文章...")
-    page.goto(url)
-
-    # 等候頁面圖片載入
-    page.wait_for_selector("img", timeout=20000)
-
-    downloaded = set()
-    index = 1
-
-    # 一律點開檢視器，逐張按下一頁
+def find_viewer_target(page):
     # 點進第一張主圖：鎖定 viewer 內的 media_image（避免頭像 img.image）
     target = page.query_selector(
         ".vw_viewer_content_wrap .media_layout .swiper-slide-active "
@@ -164,12 +513,22 @@ with sync_playwright() as p:
     if not target:
         all_imgs = page.query_selector_all("article img, main img, img")
         target = pick_largest_image(page, all_imgs)
-    if target:
-        safe_click(target, "open_viewer_target")
-    else:
-        print("找不到可點擊的圖片，請確認網址是否為單一文章。")
-        browser.close()
-        sys.exit(1)
+    return target
+
+def walk_viewer(page, fetcher, deadline=None):
+    """Open the media viewer and press through every slide, queueing each image on ``fetcher``.
+
+    Raises CrawlTimeout once ``time.monotonic()`` passes ``deadline``, e.g.
+    on a looping swiper that never reports its last slide.
+    """
+    downloaded = set()
+    index = 1
+
+    # 一律點開檢視器，逐張按下一頁
+    target = find_viewer_target(page)
+    if not target:
+        raise RuntimeError("找不到可點擊的圖片，請確認網址是否為單一文章。")
+    safe_click(target, "open_viewer_target")
 
     # 等待檢視器出現
     try:
@@ -183,6 +542,7 @@ with sync_playwright() as p:
     seen_indices = set()
 
     while True:
+        _check_deadline(deadline)
 
         # 取目前檢視器中的主圖（避免縮圖/頭貼）
         img, src, idx = get_active_viewer_info(page)
@@ -190,8 +550,7 @@ with sync_playwright() as p:
         if idx is not None:
             seen_indices.add(idx)
         if src and src not in downloaded:
-            print(f"下載第 {index} 張...")
-            download_image(src, index)
+            fetcher.submit(src, index)
             downloaded.add(src)
             index += 1
 
@@ -206,13 +565,12 @@ with sync_playwright() as p:
             safe_click(img, "active_image")
         page.keyboard.press("ArrowRight")
 
-        # 等待 0.5 秒後判斷是否切換成功
-        time.sleep(0.5)
+        # 等 swiper 真的換頁（或逾時）再判斷是否切換成功
+        wait_for_slide_change(page, prev_idx, prev_src)
         _, new_src, new_idx = get_active_viewer_info(page)
         if (new_idx is not None and new_idx != prev_idx) or (new_src and new_src != prev_src):
             if new_src and new_src not in downloaded:
-                print(f"下載第 {index} 張...")
-                download_image(new_src, index)
+                fetcher.submit(new_src, index)
                 downloaded.add(new_src)
                 index += 1
         else:
@@ -222,6 +580,87 @@ with sync_playwright() as p:
                 print("已沒有更多圖片可下載。")
             break
 
-    browser.close()
+def crawl_voom_images(page, url, save_dir=SAVE_DIR, on_image=None, timeout=None):
+    """Walk the VOOM media viewer on ``page`` and save every image into ``save_dir``.
+
+    Returns the saved file paths in slide order. ``on_image(path, idx)`` is
+    called as each image lands, before the crawl finishes. Raises
+    RuntimeError when the post has no clickable image, and CrawlTimeout when
+    the crawl takes longer than ``timeout`` seconds; no image is reported
+    after that.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    os.makedirs(save_dir, exist_ok=True)
+
+    if timeout is not None:
+        # No single Playwright call may outlive the crawl.
+        page.set_default_timeout(timeout * 1000)
+    install_block_profile(page)
+    capture = ResponseCapture(page) if CAPTURE_RESPONSES else None
+    fetcher = ImageFetcher(save_dir, capture=capture, on_saved=on_image)
+    try:
+        print("打開 LINE VOOM 文章...")
+        page.goto(url)
+
+        # 等候頁面圖片載入
+        page.wait_for_selector("img", timeout=20000)
+
+        if not (FAST_MODE and fast_collect(page, fetcher)):
+            walk_viewer(page, fetcher, deadline)
+        _check_deadline(deadline)
+    except Exception as e:
+        fetcher.close()
+        if isinstance(e, PlaywrightTimeoutError) and _past(deadline):
+            raise CrawlTimeout("爬取 VOOM 圖片逾時") from e
+        raise
+    finally:
+        if capture:
+            capture.close()
+    return fetcher.wait(deadline)
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="下載 LINE VOOM 文章圖片")
+    parser.add_argument("url", help="LINE VOOM 文章網址")
+    parser.add_argument("--out", default=SAVE_DIR, help="圖片儲存目錄")
+    parser.add_argument("--headed", action="store_true", help="顯示瀏覽器視窗（預設 headless）")
+    parser.add_argument("--viewport", default=VIEWPORT, help="例如 1280x900")
+    parser.add_argument("--scale", default=DEVICE_SCALE_FACTOR, help="device scale factor")
+    parser.add_argument("--locale", default=LOCALE)
+    parser.add_argument("--user-agent", default=USER_AGENT)
+    parser.add_argument(
+        "--chromium-args",
+        default=CHROMIUM_ARGS,
+        help="Chromium 參數，例如 \"--disable-gpu --single-process\"",
+    )
+    return parser
+
+def main(argv):
+    args = build_arg_parser().parse_args(argv[1:])
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch(
+            **launch_options(
+                headless=HEADLESS and not args.headed,
+                chromium_args=args.chromium_args,
+            )
+        )
+        context = browser.new_context(
+            **context_options(args.viewport, args.scale, args.locale, args.user_agent)
+        )
+        page = context.new_page()
+
+        print("啟動瀏覽器...")
+        try:
+            crawl_voom_images(page, args.url, args.out)
+        except RuntimeError as e:
+            print(e)
+            browser.close()
+            return 1
+
+        browser.close()
+
+    print("下載完成。")
+    return 0
 
-print("下載完成。")
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
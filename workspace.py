@@ -0,0 +1,117 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+
+from store import process_alive
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_MARKER = ".active"
+
+
+class JobWorkspace:
+    """Scratch directory owned by a single VOOM job.
+
+    Each job writes its images under ``<root>/<job_id>`` so concurrent jobs
+    never see each other's files. With ``ttl_seconds`` of 0 the directory is
+    removed as soon as the job finishes; otherwise it is kept for inspection
+    and removed by ``sweep_expired_workspaces`` once it is older than the TTL.
+    """
+
+    def __init__(self, root, job_id=None, ttl_seconds=0):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.root = root
+        self.path = os.path.join(root, self.job_id)
+        self.ttl_seconds = ttl_seconds
+
+    def __enter__(self):
+        os.makedirs(self.path, exist_ok=True)
+        # The marker names the owning process so a sweep by another worker
+        # can tell a running job from one orphaned by a crash.
+        with open(os.path.join(self.path, ACTIVE_MARKER), "w") as f:
+            f.write(str(os.getpid()))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def image_paths(self, limit=None):
+        if not os.path.isdir(self.path):
+            return []
+        files = [
+            os.path.join(self.path, name)
+            for name in os.listdir(self.path)
+            if not name.startswith(".")
+            and os.path.isfile(os.path.join(self.path, name))
+        ]
+        files.sort(key=_natural_key)
+        if limit is None:
+            return files
+        return files[:limit]
+
+    def release(self):
+        if self.ttl_seconds > 0:
+            # Drop the marker so the retention window starts when the job ends.
+            try:
+                os.remove(os.path.join(self.path, ACTIVE_MARKER))
+                os.utime(self.path)
+            except OSError:
+                pass
+            return
+        self.cleanup()
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _natural_key(path):
+    name = os.path.basename(path)
+    stem = os.path.splitext(name)[0]
+    if stem.isdigit():
+        return (0, int(stem), name)
+    return (1, 0, name)
+
+
+def _owner_alive(path):
+    try:
+        with open(os.path.join(path, ACTIVE_MARKER)) as f:
+            pid = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return False
+    return process_alive(pid)
+
+
+def sweep_expired_workspaces(root, ttl_seconds, now=None, include_active=False, keep=()):
+    """Remove job workspaces older than ``ttl_seconds``.
+
+    Workspaces of jobs still running are skipped. With ``include_active``
+    (used at startup) workspaces still marked active are removed too, unless
+    the marker belongs to another live worker process or the job id is in
+    ``keep`` (jobs about to be resumed).
+    """
+    if not os.path.isdir(root):
+        return 0
+    now = time.time() if now is None else now
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in keep:
+            continue
+        try:
+            if not os.path.isdir(path):
+                continue
+            active = os.path.exists(os.path.join(path, ACTIVE_MARKER))
+            if active and (not include_active or _owner_alive(path)):
+                continue
+            if not active and now - os.path.getmtime(path) < ttl_seconds:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info("Removed %s expired VOOM workspaces from %s", removed, root)
+    return removed